@@ -0,0 +1,34 @@
+# python -m benchmarks.bench_localization
+import gettext
+import timeit
+from localization import LOCALES_DIR, LANGUAGES, DEFAULT_LANGUAGE, get_localization
+
+N = 20000
+CODES = LANGUAGES + ['de', None]
+
+
+def uncached(language_code):
+    # What get_localization did before catalogs were preloaded.
+    lang = language_code if language_code in LANGUAGES else DEFAULT_LANGUAGE
+    translation = gettext.translation('messages', localedir=LOCALES_DIR, languages=[lang])
+    translation.install()
+    return translation.gettext
+
+
+def bench(func):
+    calls = 0
+
+    def run():
+        nonlocal calls
+        func(CODES[calls % len(CODES)])("ban_message")
+        calls += 1
+
+    return min(timeit.repeat(run, number=N, repeat=3)) / N * 1e6
+
+
+if __name__ == "__main__":
+    before = bench(uncached)
+    after = bench(get_localization)
+    print(f"gettext.translation + install: {before:.2f} µs/call")
+    print(f"get_localization (preloaded):  {after:.2f} µs/call")
+    print(f"speedup: {before / after:.0f}x")
@@ -3,8 +3,13 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from dotenv import load_dotenv
 from handlers import callbacks, ya_ocr, summary, gpt, admin, stt, neuro, qwen, pm, gemimg, tts, shazam, rephrase, forecast, flux
-from utils.StatsMiddleware import StatsMiddleware
+from utils.StatsMiddleware import StatsMiddleware, stop_flush_loop
 from utils.BanMiddleware import BanMiddleware
+from utils.CommandMiddleware import CommandMiddleware
+from utils.PrefilterMiddleware import PrefilterMiddleware
+from utils.dbmanager import start_sweeper, stop_sweeper
+from utils.config import start_config_watcher, stop_config_watcher
+from utils.http_clients import start_http_clients, close_http_clients
 from aiogram import Router, F
 
 base_router = Router()
@@ -26,8 +31,17 @@ async def main():
               default=DefaultBotProperties(allow_sending_without_reply = True))
     dp = Dispatcher()
 
+    dp.update.outer_middleware(CommandMiddleware())
+    dp.update.outer_middleware(PrefilterMiddleware())
     dp.update.middleware(BanMiddleware(bot))
     dp.update.middleware(StatsMiddleware(bot)) 
+    start_sweeper()
+    start_config_watcher()
+    dp.startup.register(start_http_clients)
+    dp.shutdown.register(close_http_clients)
+    dp.shutdown.register(stop_flush_loop)
+    dp.shutdown.register(stop_sweeper)
+    dp.shutdown.register(stop_config_watcher)
 
     base_router.include_routers(
     callbacks.router, ya_ocr.router, summary.router, gpt.router,
@@ -9,9 +9,13 @@ from aiogram import Router
 from aiogram.filters import Command
 from aiogram.filters.command import CommandObject
 from aiogram.types import Message
-from utils.dbmanager import DB
+from utils.dbmanager import DB, flush_all
 from utils.cmd_list import cmds
-from utils.StatsMiddleware import get_stats, get_all_chats
+from utils.StatsMiddleware import get_stats, get_chats_page, flush_stats, reset_stats, reset_rollups, chat_registry
+from utils.PrefilterMiddleware import format_path_counts
+from utils.circuit_breaker import format_breakers
+from utils.credential_pool import format_pools
+from utils.config import config
 from utils.command_states import get_disabled_commands, disable_command, enable_command
 from utils.BanMiddleware import (
     ban_user,
@@ -22,9 +26,12 @@ from utils.BanMiddleware import (
     is_chat_banned,
     ban_chat,
     is_banned,
+    banned_users,
+    banned_chats,
 )
 
 router = Router()
+CHATS_PAGE_SIZE = 20
 start_time = datetime.now()
 ADMIN_ID = os.getenv("ADMIN_ID")
 
@@ -108,7 +115,11 @@ def format_uptime():
         f" ├─ Resident Set Size (RSS): {proc_mem['rss']} MB\n"
         f" ├─ Virtual Memory Size (VMS): {proc_mem['vms']} MB\n"
         f" ├─ Shared Memory: {proc_mem['shared']} MB\n"
-        f" └─ Percent of RAM used: {proc_mem['percent']:.2f}%"
+        f" └─ Percent of RAM used: {proc_mem['percent']:.2f}%\n"
+        f"📨 Updates by path:\n"
+        f"{format_path_counts()}\n"
+        f"🔌 Upstreams:\n"
+        f"{format_breakers()}"
     )
 
 
@@ -289,6 +300,8 @@ async def cmd_list_disabled(message: Message):
 @router.message(Command("stop", ignore_case=True))
 @admin_only
 async def cmd_stop(message: Message):
+    flush_stats()
+    flush_all()
     os._exit(0)
 
 
@@ -305,6 +318,14 @@ async def cmd_trunc(message: Message, command: CommandObject):
     if command.args in db_list:
         database = DB(f"db/{command.args}.json").get_db()[0]
         database.truncate()
+        if command.args == "stats":
+            reset_stats()
+        if command.args == "stats_rollup":
+            reset_rollups()
+        if command.args == "chats":
+            chat_registry.reset()
+        banned_users.invalidate()
+        banned_chats.invalidate()
         await message.reply(f"База {command.args} очищена")
     else:
         await message.reply("Неверное название базы данных.")
@@ -313,11 +334,32 @@ async def cmd_trunc(message: Message, command: CommandObject):
 @router.message(Command("chats", ignore_case=True))
 @admin_only
 async def cmd_chats(message: Message, command: CommandObject):
-    message_text = ""
-    all_chats = get_all_chats()
-    for chat in all_chats:
-        message_text+="\n"+(f"Chat ID: {chat['chat_id']}, Title: {chat['chat_title']}")
-    if message_text: await message.reply(message_text)
+    page = int(command.args) - 1 if command.args and command.args.isdigit() and int(command.args) > 0 else 0
+    chats, total = get_chats_page(page, CHATS_PAGE_SIZE)
+    if not chats:
+        return
+    lines = []
+    for chat in chats:
+        last_seen = datetime.fromtimestamp(chat['last_seen']).strftime('%Y-%m-%d %H:%M') if chat['last_seen'] else '—'
+        lines.append(f"Chat ID: {chat['chat_id']}, Title: {chat['chat_title']}, Last seen: {last_seen}")
+    pages = (total + CHATS_PAGE_SIZE - 1) // CHATS_PAGE_SIZE
+    await message.reply("\n".join(lines) + f"\n\nСтраница {page + 1}/{pages}, всего чатов: {total}")
+
+
+@router.message(Command("keys", ignore_case=True))
+@admin_only
+async def cmd_keys(message: Message):
+    await message.reply(format_pools())
+
+
+@router.message(Command("reload", ignore_case=True))
+@admin_only
+async def cmd_reload(message: Message):
+    changed = config.reload(force=True)
+    if changed:
+        await message.reply(f"Конфигурация перечитана (версия {config.version}), изменено: {', '.join(changed)}")
+    else:
+        await message.reply("Конфигурация перечитана, изменений нет.")
 
 
 @router.message(Command("stats", ignore_case=True))
@@ -9,27 +9,22 @@ from handlers.shazam import shazam_command
 from utils.StatsMiddleware import save_stats
 #from handlers.gpt import process_gpt
 from handlers.qwen import cmd_qwen
-from datetime import datetime, timedelta
+from utils.RateLimiter import callback_limiter
 from functools import wraps
 
 router = Router() 
 
-user_cooldowns = {}
-
 def rate_limit(seconds: int = 5):
     def decorator(func):
         @wraps(func)
         async def wrapper(callback_query: CallbackQuery, *args, **kwargs):
             user_id = callback_query.from_user.id
-            user_language = callback_query.from_user.language_code or DEFAULT_LANGUAGE
-            _ = get_localization(user_language)
-            current_time = datetime.now()            
-            last_request_time = user_cooldowns.get(user_id)
-            if last_request_time and (current_time - last_request_time) < timedelta(seconds=seconds):
+            if not (await callback_limiter.hit(user_id, seconds)).allowed:
+                user_language = callback_query.from_user.language_code or DEFAULT_LANGUAGE
+                _ = get_localization(user_language)
                 await callback_query.answer(_("throttle_wait").format(seconds=seconds), show_alert=True)
                 return
-            
-            user_cooldowns[user_id] = current_time
+
             return await func(callback_query, *args, **kwargs)
         return wrapper
     return decorator
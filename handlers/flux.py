@@ -8,8 +8,11 @@ import aiohttp
 import base64
 import tempfile
 import os
+from utils.http_clients import http_session
+from utils.circuit_breaker import get_breaker
 
 router = Router()
+flux_breaker = get_breaker("flux")
 
 @router.message(Command("flux", ignore_case=True))
 @check_command_enabled("flux")
@@ -59,34 +62,37 @@ async def cmd_flux(message: Message, command: CommandObject, bot: Bot):
         }
 
         async with TypingIndicator(bot=bot, chat_id=message.chat.id):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.options(
-                        "https://api.deepinfra.com/v1/openai/images/generations",
-                        headers={
-                            "Accept": "*/*",
-                            "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7,zh-CN;q=0.6,zh;q=0.5,ja;q=0.4,de;q=0.3",
-                            "Cache-Control": "no-cache",
-                            "Connection": "keep-alive",
-                            "Origin": "http://localhost:8080",
-                            "Pragma": "no-cache",
-                            "Referer": "http://localhost:8080/",
-                            "Sec-Fetch-Dest": "empty",
-                            "Sec-Fetch-Mode": "cors",
-                            "Sec-Fetch-Site": "cross-site",
-                            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36",
-                            "Access-Control-Request-Headers": "content-type",
-                            "Access-Control-Request-Method": "POST"
-                        },
-                        timeout=30
-                    ) as options_response:
-                        if options_response.status not in (200, 204):
-                            print(f"Preflight failed: {options_response.status}")
-            except Exception as e:
-                print(f"Preflight error (non-critical): {e}")
+            # No preflight while the upstream is known to be down.
+            if not flux_breaker.is_open():
+                try:
+                    async with http_session("flux") as session:
+                        async with session.options(
+                            "https://api.deepinfra.com/v1/openai/images/generations",
+                            headers={
+                                "Accept": "*/*",
+                                "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7,zh-CN;q=0.6,zh;q=0.5,ja;q=0.4,de;q=0.3",
+                                "Cache-Control": "no-cache",
+                                "Connection": "keep-alive",
+                                "Origin": "http://localhost:8080",
+                                "Pragma": "no-cache",
+                                "Referer": "http://localhost:8080/",
+                                "Sec-Fetch-Dest": "empty",
+                                "Sec-Fetch-Mode": "cors",
+                                "Sec-Fetch-Site": "cross-site",
+                                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36",
+                                "Access-Control-Request-Headers": "content-type",
+                                "Access-Control-Request-Method": "POST"
+                            },
+                            timeout=30
+                        ) as options_response:
+                            if options_response.status not in (200, 204):
+                                print(f"Preflight failed: {options_response.status}")
+                except Exception as e:
+                    print(f"Preflight error (non-critical): {e}")
 
             timeout = aiohttp.ClientTimeout(total=300)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
+            api_error = None
+            async with flux_breaker.call() as call, http_session("flux") as session:
                 async with session.post(
                     "https://api.deepinfra.com/v1/openai/images/generations",
                     headers=headers,
@@ -95,20 +101,26 @@ async def cmd_flux(message: Message, command: CommandObject, bot: Bot):
                 ) as response:
 
                     if response.status != 200:
-                        error_text = await response.text()
-                        raise Exception(f"API Error {response.status}: {error_text}")
+                        # Only 5xx counts against the breaker; a rejected
+                        # request is raised once the call is closed.
+                        if response.status >= 500:
+                            call.fail()
+                        api_error = f"API Error {response.status}: {await response.text()}"
+                    else:
+                        result = await response.json()
+
+            if api_error:
+                raise Exception(api_error)
+
+            if "data" not in result or not result["data"]:
+                raise Exception("No image data in response")
 
-                    result = await response.json()
-                    
-                    if "data" not in result or not result["data"]:
-                        raise Exception("No image data in response")
-                    
-                    b64_image = result["data"][0]["b64_json"]
-                    image_bytes = base64.b64decode(b64_image)
+            b64_image = result["data"][0]["b64_json"]
+            image_bytes = base64.b64decode(b64_image)
 
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                        tmp.write(image_bytes)
-                        image_path = tmp.name
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
+                tmp.write(image_bytes)
+                image_path = tmp.name
 
         await sent_message.delete()
         await message.reply_photo(photo=FSInputFile(image_path))
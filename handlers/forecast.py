@@ -1,4 +1,3 @@
-import aiohttp
 from collections import defaultdict
 from datetime import datetime
 from io import BytesIO
@@ -9,7 +8,8 @@ from aiogram.types import Message, BufferedInputFile
 
 from utils.command_states import check_command_enabled
 from utils.typing_indicator import TypingIndicator
-from utils.dbmanager import DB
+from utils.dbmanager import AsyncDB
+from utils.http_clients import http_session
 from localization import DEFAULT_LANGUAGE, get_localization
 
 from PIL import Image, ImageDraw, ImageFont
@@ -59,7 +59,7 @@ WEATHER_CODES = {
 }
 
 router = Router()
-city_db, CityQuery = DB("db/user_cities.json").get_db()
+city_db, CityQuery = AsyncDB("db/user_cities.json").get_db()
 
 
 def fit_text(draw, text, w, h, s):
@@ -119,7 +119,7 @@ def iy(y, icon):
 
 
 async def get_coordinates(city: str):
-    async with aiohttp.ClientSession() as session:
+    async with http_session("forecast") as session:
         async with session.get(
             "https://nominatim.openstreetmap.org/search",
             params={"q": city, "format": "json", "limit": 5, "addressdetails": 1},
@@ -158,7 +158,7 @@ async def get_coordinates(city: str):
 
 
 async def get_weather(lat, lon):
-    async with aiohttp.ClientSession() as session:
+    async with http_session("forecast") as session:
         async with session.get(
             "https://api.open-meteo.com/v1/forecast",
             params={
@@ -414,7 +414,7 @@ async def forecast_command(message: Message, command: CommandObject, bot: Bot):
     city = command.args.strip() if command.args else None
 
     if not city:
-        saved = city_db.get(CityQuery().uid == user_id)
+        saved = await city_db.get(CityQuery().uid == user_id)
         if not saved:
             await message.reply(_("forecast_help"), parse_mode="Markdown")
             return
@@ -428,7 +428,7 @@ async def forecast_command(message: Message, command: CommandObject, bot: Bot):
 
             sticker = draw_card(data)
 
-            city_db.upsert(
+            await city_db.upsert(
                 {"uid": user_id, "city": city},
                 CityQuery().uid == user_id
             )
@@ -3,8 +3,12 @@ import re
 import tempfile
 import asyncio
 import json
+import time
 
-import httpx
+from utils.http_clients import get_httpx_client
+from utils.retry import RetryPolicy
+from utils.credential_pool import get_pool, mask
+from utils.config import config
 from PIL import Image as PILImage
 
 from aiogram import Router, Bot, F
@@ -29,6 +33,8 @@ QUALITY_HINT = "Ultra high quality, sharp focus, finely detailed, no compression
 
 PSIDTS_PLACEHOLDER = "sidts-cookie"
 
+MAX_REDIRECTS = 10
+
 LANGUAGE_HINT = (
     "If, for any reason (including hitting a usage limit or quota), you cannot "
     "generate the image right now, write that explanation in English."
@@ -38,9 +44,15 @@ _TRAILING_MARKER_RE = re.compile(r"[\s]*_\d+_?\s*$")
 
 _cookie_pairs: list[tuple[str, str]] = []
 _clients: list[GeminiClient | None] = []
-_active_index = 0
-_locked_at_zero = False
 _client_lock = asyncio.Lock()
+# Accounts stay sticky: requests keep going to the last account that
+# worked, as the web client keeps a session per account, until it runs
+# out of quota and is parked for QUOTA_COOLDOWN.
+gemimg_accounts = get_pool("gemimg", label=lambda pair: mask(pair[0]), sticky=True)
+QUOTA_COOLDOWN = 3600
+# Switching to the next account needs no pause, but still spends the
+# shared retry budget.
+gemimg_retry = RetryPolicy("gemimg", base_delay=0)
 
 
 def _strip_trailing_marker(text: str | None) -> str:
@@ -59,6 +71,7 @@ def _ensure_cookie_state():
     if not _cookie_pairs:
         _cookie_pairs = _parse_cookie_pairs()
         _clients = [None] * len(_cookie_pairs)
+        gemimg_accounts.set_credentials(_cookie_pairs)
 
 
 async def _get_or_create_client(idx: int) -> "GeminiClient":
@@ -68,47 +81,55 @@ async def _get_or_create_client(idx: int) -> "GeminiClient":
         await gclient.init(timeout=300, auto_close=False, auto_refresh=False)
         gclient._bot_psid = psid
         gclient._bot_psidts = psidts
+        if _cookie_pairs[idx:idx + 1] != [(psid, psidts)]:
+            # The cookies were reloaded while the client started.
+            return gclient
         _clients[idx] = gclient
 
     return _clients[idx]
 
 
-async def get_active_client():
+@config.on_reload
+def _reload_cookie_pairs(snapshot):
+    # Keeps the clients of accounts whose cookies did not change; the
+    # cookies are read lazily, so nothing to do before the first request.
+    global _cookie_pairs, _clients
+
+    if not _cookie_pairs:
+        return
+    pairs = _parse_cookie_pairs(snapshot)
+    if pairs == _cookie_pairs:
+        return
+    clients = dict(zip(_cookie_pairs, _clients))
+    _clients = [clients.get(pair) for pair in pairs]
+    _cookie_pairs = pairs
+    gemimg_accounts.set_credentials(pairs)
+
+
+async def get_active_client(tried=()):
     async with _client_lock:
         _ensure_cookie_state()
 
-        if not _cookie_pairs:
+        account = gemimg_accounts.acquire(exclude=tried)
+        if account is None:
             return None, None
 
-        idx = _active_index
-        gclient = await _get_or_create_client(idx)
-        return idx, gclient
-
+        gclient = await _get_or_create_client(account.index)
+        return account, gclient
 
-async def handle_quota_exceeded(failed_idx: int):
-    global _active_index, _locked_at_zero
-
-    async with _client_lock:
-        n = len(_cookie_pairs)
-        if n <= 1:
-            return
 
-        if failed_idx == 0 and _locked_at_zero:
-            return
+# Accounts are passed around as pool credentials rather than indexes, which
+# can shift when the cookies are reloaded during a request.
+def handle_quota_exceeded(account):
+    gemimg_accounts.failure(account, "quota", QUOTA_COOLDOWN)
 
-        next_idx = (failed_idx + 1) % n
-        _active_index = next_idx
 
-        if next_idx == 0:
-            _locked_at_zero = True
+def handle_error(account, error: Exception):
+    gemimg_accounts.failure(account, detail=type(error).__name__)
 
 
-async def handle_success(succeeded_idx: int):
-    global _locked_at_zero
-
-    if succeeded_idx == 0 and _locked_at_zero:
-        async with _client_lock:
-            _locked_at_zero = False
+def handle_success(account, latency: float = None):
+    gemimg_accounts.success(account, latency)
 
 
 def _is_quota_exceeded_text(text: str) -> bool:
@@ -128,9 +149,10 @@ def _is_quota_exceeded_text(text: str) -> bool:
     return False
 
 
-def _parse_cookie_pairs() -> list[tuple[str, str]]:
-    psid_env = os.environ.get("GEMINI_SECURE_1PSID", "") or ""
-    psidts_env = os.environ.get("GEMINI_SECURE_1PSIDTS", "") or ""
+def _parse_cookie_pairs(snapshot=None) -> list[tuple[str, str]]:
+    snapshot = snapshot or config.snapshot
+    psid_env = snapshot.get("GEMINI_SECURE_1PSID", "") or ""
+    psidts_env = snapshot.get("GEMINI_SECURE_1PSIDTS", "") or ""
 
     psids = [p.strip() for p in psid_env.split(";")]
     psids = [p for p in psids if p]
@@ -215,6 +237,18 @@ async def extract_prompt_from_response(text):
         return None
 
 
+async def _download(url: str, headers: dict):
+    # httpx drops an explicit Cookie header on redirect, so redirects are
+    # followed here with the account's cookies on every hop.
+    http_client = get_httpx_client("gemimg")
+    for _ in range(MAX_REDIRECTS):
+        resp = await http_client.get(url, headers=headers, timeout=30, follow_redirects=False)
+        if not resp.is_redirect:
+            break
+        url = resp.url.join(resp.headers["location"])
+    return resp
+
+
 async def _save_image(image, tmp_dir: str, gclient: "GeminiClient") -> str | None:
     tmp_path = os.path.join(tmp_dir, f"{next(tempfile._get_candidate_names())}.png")
 
@@ -248,25 +282,24 @@ async def _save_image(image, tmp_dir: str, gclient: "GeminiClient") -> str | Non
         pass
 
     try:
-        cookies = {
-            "__Secure-1PSID": getattr(gclient, "_bot_psid", ""),
-            "__Secure-1PSIDTS": getattr(gclient, "_bot_psidts", ""),
-        }
         headers = {
             "User-Agent": (
                 "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
                 "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
-            )
+            ),
+            "Cookie": (
+                f"__Secure-1PSID={getattr(gclient, '_bot_psid', '')}; "
+                f"__Secure-1PSIDTS={getattr(gclient, '_bot_psidts', '')}"
+            ),
         }
-        async with httpx.AsyncClient(follow_redirects=True, timeout=30, cookies=cookies, headers=headers) as http_client:
-            resp = await http_client.get(download_url)
+        resp = await _download(download_url, headers)
 
-            if resp.status_code == 400 and download_url != original_url:
-                resp = await http_client.get(original_url)
+        if resp.status_code == 400 and download_url != original_url:
+            resp = await _download(original_url, headers)
 
-            resp.raise_for_status()
-            with open(tmp_path, "wb") as f:
-                f.write(resp.content)
+        resp.raise_for_status()
+        with open(tmp_path, "wb") as f:
+            f.write(resp.content)
 
         if os.path.getsize(tmp_path) > 0 and _is_valid_image(tmp_path):
             return tmp_path
@@ -286,26 +319,27 @@ async def generate_image_gemini_web(user_input, image_paths=None):
     tmp_dir = tempfile.mkdtemp()
 
     last_text = None
-    tried_indexes = set()
+    tried_accounts = set()
+    gemimg_retry.start()
 
     for attempt in range(max_attempts):
-        idx, gclient = await get_active_client()
+        account, gclient = await get_active_client(tried_accounts)
 
         if gclient is None:
             break
 
-        if idx in tried_indexes:
-            break
-
-        tried_indexes.add(idx)
+        tried_accounts.add(account)
 
+        started = time.monotonic()
         try:
             if files:
                 response = await gclient.generate_content(enhanced_prompt, files=files, model="gemini-flash-lite")
             else:
                 response = await gclient.generate_content(enhanced_prompt, model="gemini-flash-lite")
-        except Exception:
+        except Exception as e:
+            handle_error(account, e)
             return [], None
+        latency = time.monotonic() - started
 
         image_paths_result = []
         response_text = None
@@ -317,17 +351,19 @@ async def generate_image_gemini_web(user_input, image_paths=None):
                     image_paths_result.append(saved)
 
             if image_paths_result:
-                await handle_success(idx)
+                handle_success(account, latency)
                 if response.text:
                     response_text = response.text
                 return image_paths_result, response_text
 
         if response.text and _is_quota_exceeded_text(response.text):
-            await handle_quota_exceeded(idx)
+            handle_quota_exceeded(account)
             last_text = response.text
-            continue
+            if await gemimg_retry.wait(attempt, max_attempts=max_attempts):
+                continue
+            break
 
-        await handle_success(idx)
+        handle_success(account, latency)
 
         if response.text:
             extracted_prompt = await extract_prompt_from_response(response.text)
@@ -353,9 +389,11 @@ async def generate_image_gemini_web(user_input, image_paths=None):
                             return image_paths_result, response_text
 
                     if second_response.text and _is_quota_exceeded_text(second_response.text):
-                        await handle_quota_exceeded(idx)
+                        handle_quota_exceeded(account)
                         last_text = second_response.text
-                        continue
+                        if await gemimg_retry.wait(attempt, max_attempts=max_attempts):
+                            continue
+                        break
 
                     if second_response.text:
                         response_text = second_response.text
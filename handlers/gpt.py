@@ -1,11 +1,10 @@
 import asyncio
 import base64
 import json
-import os
 import aiohttp
+import os
 import re
 import time
-import itertools
 from handlers.callbacks import rate_limit
 from utils.markdownify import markdownify as md
 from io import BytesIO
@@ -22,9 +21,15 @@ from aiogram.types import (
 from pylatexenc.latex2text import LatexNodes2Text
 
 from localization import get_localization, DEFAULT_LANGUAGE
-from utils.dbmanager import DB
+from utils.dbmanager import AsyncDB
 from chatgpt_md_converter import telegram_format
 from utils.command_states import check_command_enabled
+from utils.ConversationStore import open_conversations
+from utils.http_clients import http_session
+from utils.circuit_breaker import get_breaker
+from utils.retry import RetryPolicy, retry_after
+from utils.credential_pool import get_pool
+from utils.config import config
 
 _raw_gemini_keys = os.environ.get("GEMINI_API_KEY")
 
@@ -38,13 +43,14 @@ def parse_gemini_keys(value: str) -> list[str]:
 
 
 GEMINI_KEYS = parse_gemini_keys(_raw_gemini_keys)
-_gemini_key_cycle = itertools.cycle(GEMINI_KEYS)
-_gemini_key_lock = asyncio.Lock()
+gemini_keys = get_pool("gemini", GEMINI_KEYS)
 
 
-async def get_next_gemini_key() -> str:
-    async with _gemini_key_lock:
-        return next(_gemini_key_cycle)
+@config.on_reload
+def _load_gemini_keys(snapshot):
+    keys = parse_gemini_keys(snapshot.get("GEMINI_API_KEY") or "")
+    if keys:
+        gemini_keys.set_credentials(keys)
 
 
 GEMINI_MODEL_NAME = "gemini-2.5-flash"
@@ -57,8 +63,13 @@ GPT_API_URL = os.environ.get("GPT_API_URL")
 
 router = Router()
 
-db, Query = DB("db/gpt_models.json").get_db()
-context_db, ContextQuery = DB("db/gpt_context.json").get_db()
+db, Query = AsyncDB("db/gpt_models.json").get_db()
+CONTEXT_TTL = 3 * 3600
+conversations = open_conversations("db/gpt_context", ttl=CONTEXT_TTL)
+gpt_breaker = get_breaker("gpt")
+gemini_breaker = get_breaker("gemini")
+gpt_retry = RetryPolicy("gpt", retry_exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
+gemini_retry = RetryPolicy("gemini", retry_exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
 
 
 models = {
@@ -94,14 +105,9 @@ async def update_model_message(callback_query: CallbackQuery, model: str):
 async def callback_query_handler(callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
     getmodel = Query()
-    db_item = db.get(getmodel.uid == user_id)
+    await db.upsert({"uid": user_id, "model": callback_query.data}, getmodel.uid == user_id)
 
-    if not db_item:
-        db.insert({"uid": user_id, "model": callback_query.data})
-    else:
-        db.update({"model": callback_query.data}, getmodel.uid == user_id)
-
-    remove_user_context(user_id)
+    await remove_user_context(user_id)
     await callback_query.answer()
     await update_model_message(callback_query, callback_query.data)
 
@@ -112,42 +118,16 @@ async def callback_query_handler(callback_query: CallbackQuery):
 )
     
 
-def load_user_context(user_id):
-    context_item = context_db.get(ContextQuery().uid == user_id)
-    if context_item:
-        last_modified_time = float(context_item.get("last_modified_time", 0))
-        if time.time() - last_modified_time < 3 * 3600:
-            return (
-                json.loads(
-                    base64.b64decode(context_item.get("chat_messages")).decode("utf-8")
-                ),
-                context_item.get("chat_vqd"),
-                context_item.get("chat_vqd_hash"),
-            )
-    return None, None, None
+async def load_user_context(user_id):
+    return await conversations.load(user_id)
 
 
-def save_user_context(user_id, chat_messages, chat_vqd, chat_vqd_hash):
-    encoded_chat_messages = base64.b64encode(
-        json.dumps(chat_messages, ensure_ascii=False).encode("utf-8")
-    ).decode("utf-8")
+async def save_user_context(user_id, *messages):
+    await conversations.append(user_id, *messages)
 
-    context_data = {
-        "uid": user_id,
-        "chat_messages": encoded_chat_messages,
-        "chat_vqd": chat_vqd,
-        "chat_vqd_hash": chat_vqd_hash,
-        "last_modified_time": time.time(),
-    }
-
-    if context_db.get(ContextQuery().uid == user_id):
-        context_db.update(context_data, ContextQuery().uid == user_id)
-    else:
-        context_db.insert(context_data)
 
-
-def remove_user_context(user_id):
-    context_db.remove(ContextQuery().uid == user_id)
+async def remove_user_context(user_id):
+    await conversations.clear(user_id)
 
 
 def process_latex(text):
@@ -179,8 +159,6 @@ async def process_gemini(message: Message, command: CommandObject, bot: Bot, pho
         await bot.download_file(file.file_path, destination=photo_stream)
         image_bytes = photo_stream.getvalue()
 
-        api_key = await get_next_gemini_key()
-
         payload = {
             "contents": [
                 {
@@ -197,21 +175,53 @@ async def process_gemini(message: Message, command: CommandObject, bot: Bot, pho
             ]
         }
 
-        url = (
-            f"{GEMINI_BASE_URL}/"
-            f"{GEMINI_MODEL_NAME}:generateContent"
-            f"?key={api_key}"
-        )
-
+        # A rejected or exhausted key is swapped for the next one; network
+        # errors are retried with backoff on the same key.
+        data = None
+        tried = set()
+        attempt = 0
+        gemini_retry.start()
         async with TypingIndicator(bot=bot, chat_id=message.chat.id):
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as resp:
-                    if resp.status != 200:
-                        print(await resp.text())
-                        await message.reply(_("gpt_gemini_error"))
-                        return
-
-                    data = await resp.json()
+            key = gemini_keys.acquire()
+            while key is not None:
+                url = (
+                    f"{GEMINI_BASE_URL}/"
+                    f"{GEMINI_MODEL_NAME}:generateContent"
+                    f"?key={key.value}"
+                )
+                started = time.monotonic()
+                status = delay = None
+                async with gemini_breaker.call() as call, http_session("gemini") as session:
+                    try:
+                        async with session.post(url, json=payload) as resp:
+                            gemini_keys.report(key, resp.status, time.monotonic() - started, retry_after(resp))
+                            if resp.status >= 500:
+                                call.fail()
+                            body = await resp.text()
+                            status, delay = resp.status, retry_after(resp)
+                    except gemini_retry.retry_exceptions as e:
+                        call.fail()
+                        print("Gemini error:", e)
+
+                if status == 200:
+                    data = json.loads(body)
+                    break
+                if status in (401, 403, 429):
+                    print(body)
+                    tried.add(key)
+                    key = gemini_keys.acquire(exclude=tried)
+                    continue
+                if status is not None:
+                    print(body)
+                    if not gemini_retry.is_retryable(status=status):
+                        break
+                if not await gemini_retry.wait(attempt, delay):
+                    break
+                attempt += 1
+
+        if data is None:
+            await message.reply(_("gpt_gemini_error"))
+            return
 
         for candidate in data.get("candidates", []):
             for part in candidate.get("content", {}).get("parts", []):
@@ -229,26 +239,37 @@ async def process_gemini(message: Message, command: CommandObject, bot: Bot, pho
 
 
 async def request_gpt_api(model_key: str, messages_for_api: list, max_attempts: int = 3):
-    last_error = None
-    for attempt in range(1, max_attempts + 1):
+    gpt_retry.start()
+    for attempt in range(max_attempts):
+        delay = None
         try:
-            async with aiohttp.ClientSession() as session:
+            async with gpt_breaker.call() as call, http_session("gpt") as session:
                 async with session.post(
                     GPT_API_URL,
                     json={"model": models[model_key], "messages": messages_for_api},
                     timeout=60,
                 ) as resp:
-                    data = await resp.json()
-
-            return data["choices"][0]["message"]["content"]
-
+                    if resp.status >= 500:
+                        call.fail()
+                    status = resp.status
+                    delay = retry_after(resp)
+                    body = await resp.text()
         except Exception as e:
-            last_error = e
-            print(f"GPT request attempt {attempt}/{max_attempts} failed:", e)
-            if attempt < max_attempts:
-                await asyncio.sleep(1)
+            print(f"GPT request attempt {attempt + 1}/{max_attempts} failed:", e)
+            if not gpt_retry.is_retryable(error=e) or not await gpt_retry.wait(attempt, delay, max_attempts):
+                raise
+            continue
 
-    raise last_error
+        if status != 200:
+            print(f"GPT request attempt {attempt + 1}/{max_attempts} failed: {status} {body[:200]}")
+            if gpt_retry.is_retryable(status=status) and await gpt_retry.wait(attempt, delay, max_attempts):
+                continue
+            raise Exception(f"GPT API error {status}")
+
+        # Parsed after the call is closed: a malformed body is not an
+        # upstream failure for the breaker.
+        data = json.loads(body)
+        return data["choices"][0]["message"]["content"]
 
 
 async def process_gpt(message: Message, command: CommandObject, user_id):
@@ -258,7 +279,7 @@ async def process_gpt(message: Message, command: CommandObject, user_id):
     messagetext = messagetext.strip()
 
     model = "gpt-5.4-nano"
-    user_model = db.get(Query().uid == user_id)
+    user_model = await db.get(Query().uid == user_id)
     if user_model and user_model["model"] in models:
         model = user_model["model"]
 
@@ -273,20 +294,15 @@ async def process_gpt(message: Message, command: CommandObject, user_id):
         return
 
     try:
-        chat_messages, _, _ = load_user_context(user_id)
-        messages_for_api = (
-            chat_messages + [{"role": "user", "content": messagetext}]
-            if chat_messages
-            else [{"role": "user", "content": messagetext}]
-        )
+        user_message = {"role": "user", "content": messagetext}
+        messages_for_api = await load_user_context(user_id) + [user_message]
 
         async with TypingIndicator(bot=message.bot, chat_id=message.chat.id):
             answer = await request_gpt_api(model, messages_for_api, max_attempts=3)
 
-        chat_messages = messages_for_api + [
-            {"role": "assistant", "content": answer}
-        ]
-        save_user_context(user_id, chat_messages, None, None)
+        await save_user_context(
+            user_id, user_message, {"role": "assistant", "content": answer}
+        )
 
         answer = process_latex(telegram_format(answer))
         answer = remove_citation_tags(answer)
@@ -320,7 +336,7 @@ async def cmd_gpt(message: Message, command: CommandObject, bot: Bot):
 
 @router.message(Command("gptrm", ignore_case=True))
 async def cmd_remove_context(message: Message):
-    remove_user_context(message.from_user.id)
+    await remove_user_context(message.from_user.id)
     await message.reply(
         get_localization(message.from_user.language_code or DEFAULT_LANGUAGE)(
             "gpt_ctx_removed"
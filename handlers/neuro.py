@@ -1,4 +1,3 @@
-import aiohttp
 import asyncio
 import re
 
@@ -10,6 +9,7 @@ from utils.command_states import check_command_enabled
 
 from chatgpt_md_converter import telegram_format
 from localization import DEFAULT_LANGUAGE, get_localization
+from utils.http_clients import http_session
 #from utils.translate import translate_text
 
 router = Router() 
@@ -29,7 +29,7 @@ async def send_request(user_request):
     url = 'https://yandex.kz/neuralsearch/api/send_to_dialog?lr='
     data = {"UserRequest": user_request}
 
-    async with aiohttp.ClientSession() as session:
+    async with http_session("neuro", cookies=True) as session:
         async with session.post(url,  json=data) as res:
             try:
                 response = await res.json()
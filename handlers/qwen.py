@@ -4,42 +4,53 @@ from aiogram import Router, Bot
 from aiogram.filters import Command, CommandObject
 from aiogram.types import Message
 from aiogram.exceptions import TelegramBadRequest
-import aiohttp, asyncio, json, os, time
+import aiohttp, asyncio, json
 from chatgpt_md_converter import telegram_format
-from utils.dbmanager import DB
 from localization import get_localization, DEFAULT_LANGUAGE
 from utils.command_states import check_command_enabled
-from dotenv import load_dotenv
+from utils.ConversationStore import open_conversations
+from utils.config import config
 from pylatexenc.latex2text import LatexNodes2Text
 import re
-import threading
-
-context_db, ContextQuery = DB("db/qwen_context.json").get_db()
-router = Router()
+import time
+from utils.http_clients import http_session
+from utils.circuit_breaker import CircuitOpenError, get_breaker
+from utils.retry import RetryPolicy, retry_after
+from utils.credential_pool import get_pool, mask
 
 MESSAGE_EXPIRY = 3 * 60 * 60
 
-current_key_index = 0
-key_lock = threading.Lock()
+conversations = open_conversations("db/qwen_context", ttl=MESSAGE_EXPIRY)
+qwen_breaker = get_breaker("qwen", max_in_flight=30)
+qwen_retry = RetryPolicy("qwen", max_delay=10, retry_exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
+# Rotated past without spending retry budget.
+KEY_ROTATION_STATUSES = (401, 403)
+qwen_pool = get_pool("qwen", label=lambda key: mask(key.get("bearer", "")))
+router = Router()
+
 chat_in_progress_locks = {}
 chat_lock_timeout = 30
 
+_qwen_keys = ()
+
+@config.on_reload
+def _load_qwen_keys(snapshot):
+    global _qwen_keys
+    try:
+        qwen_keys = json.loads(snapshot.get("QWEN_ACCS") or "[]")
+    except ValueError as e:
+        print(f"Ошибка чтения QWEN_ACCS: {e}")
+        return
+    _qwen_keys = tuple(qwen_keys)
+    qwen_pool.set_credentials(_qwen_keys)
+
 def load_keys_from_env():
-    load_dotenv(override=True)
-    qwen_keys = json.loads(os.getenv("QWEN_ACCS") or "[]")
-    if not qwen_keys:
+    if not _qwen_keys:
         raise ValueError("No Qwen accounts configured")
-    return qwen_keys
+    return _qwen_keys
 
 def get_next_key():
-    global current_key_index
-    
-    qwen_keys = load_keys_from_env()
-    
-    with key_lock:
-        key = qwen_keys[current_key_index]
-        current_key_index = (current_key_index + 1) % len(qwen_keys)
-        return key
+    return qwen_pool.acquire()
 
 async def get_headers_with_key(key):
     headers = {
@@ -48,6 +59,22 @@ async def get_headers_with_key(key):
     }
     return headers
 
+def _chat_in_progress(body: str) -> bool:
+    try:
+        return json.loads(body).get("error", {}).get("message") == "The chat is in progress!"
+    except (ValueError, AttributeError):
+        return False
+
+async def post_qwen(url: str, key, json_data: dict, timeout: int):
+    headers = await get_headers_with_key(key.value)
+    started = time.monotonic()
+    async with qwen_breaker.call() as call, http_session("qwen") as session:
+        async with session.post(url, headers=headers, json=json_data, timeout=timeout) as response:
+            qwen_pool.report(key, response.status, time.monotonic() - started, retry_after(response))
+            if response.status >= 500:
+                call.fail()
+            return response.status, await response.text(), retry_after(response)
+
 async def wait_for_chat_lock(user_id):
     lock_key = f"chat_lock_{user_id}"
     
@@ -74,33 +101,14 @@ def release_chat_lock(user_id):
         except RuntimeError:
             pass
 
-def load_context(user_id):
-    context_item = context_db.get(ContextQuery().uid == user_id)
-    if context_item:
-        messages = json.loads(context_item.get("messages", "[]"))
-        timestamp = float(context_item.get("timestamp", 0))
-        if time.time() - timestamp < MESSAGE_EXPIRY:
-            return messages
-    return []
-
-def save_context(user_id, messages):
-    getcontext = ContextQuery().uid == user_id
-    context_item = context_db.get(getcontext)
-
-    new_data = {
-        "uid": user_id,
-        "messages": json.dumps(messages, ensure_ascii=False),
-        "timestamp": time.time(),
-    }
+async def load_context(user_id):
+    return await conversations.load(user_id)
 
-    if context_item:
-        context_db.update(new_data, getcontext)
-    else:
-        context_db.insert(new_data)
+async def save_context(user_id, *messages):
+    await conversations.append(user_id, *messages)
 
-def remove_messages(user_id):
-    getcontext = ContextQuery()
-    context_db.remove(getcontext.uid == user_id)
+async def remove_messages(user_id):
+    await conversations.clear(user_id)
 
 def process_latex(text):
     code_blocks = {}
@@ -168,18 +176,19 @@ async def cmd_qwen(message: Message, command: CommandObject, bot: Bot, id=None,
         return
     
     try:
-        messages = load_context(user_id)
-        messages.append({"role": "user", "content": user_input})
+        messages = await load_context(user_id)
+        user_message = {"role": "user", "content": user_input}
+        messages.append(user_message)
 
         async with TypingIndicator(bot=bot, chat_id=message.chat.id):
             qwen_keys = load_keys_from_env()
             max_retries = len(qwen_keys) * 2
             last_error = None
+            qwen_retry.start()
             
             for attempt in range(max_retries):
                 try:
                     current_key = get_next_key()
-                    headers = await get_headers_with_key(current_key)
                     
                     json_data = {
                         "model": "qwen3.7-max",
@@ -187,62 +196,61 @@ async def cmd_qwen(message: Message, command: CommandObject, bot: Bot, id=None,
                         "stream": False,
                     }
 
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            "https://qwen.aikit.club/v1/chat/completions",
-                            headers=headers,
-                            json=json_data,
-                            timeout=180
-                        ) as response:
-                            
-                            if response.status == 400:
-                                error_data = await response.json()
-                                if error_data.get("error", {}).get("message") == "The chat is in progress!":
-                                    await asyncio.sleep(1)
-                                    continue
-                            
-                            if response.status != 200:
-                                error_text = await response.text()
-                                if response.status in [401, 403, 429, 500, 502, 503, 504]:
-                                    await asyncio.sleep(1)
-                                    continue
-                                else:
-                                    raise Exception(f"API error {response.status}: {error_text}")
-                            
-                            result = await response.json()
-                            
-                            if "choices" in result and len(result["choices"]) > 0:
-                                assistant_message = result["choices"][0]["message"]
-                                response_text = assistant_message.get("content", "")
-                                
-                                messages.append(assistant_message)
-                                save_context(user_id, messages)
-                                
-                                if response_text.strip():
-                                    response_text = remove_details_tags(response_text)
-                                    formatted_reply = process_latex(telegram_format(response_text))
-                                    chunks = split_html(formatted_reply)
-                                    
-                                    for chunk in chunks:
-                                        await message.reply(chunk, parse_mode="HTML")
-                                else:
-                                    await message.reply(_("qwen_error"))
-                                return
-                            else:
-                                continue
+                    status, body, delay = await post_qwen(
+                        "https://qwen.aikit.club/v1/chat/completions", current_key, json_data, timeout=180
+                    )
+
+                    if status == 400 and _chat_in_progress(body):
+                        if await qwen_retry.wait(attempt, max_attempts=max_retries):
+                            continue
+                        break
+
+                    if status in KEY_ROTATION_STATUSES:
+                        last_error = Exception(f"API error {status}: {body}")
+                        continue
+
+                    if status != 200:
+                        last_error = Exception(f"API error {status}: {body}")
+                        if qwen_retry.is_retryable(status=status) and await qwen_retry.wait(attempt, delay, max_retries):
+                            continue
+                        break
+
+                    result = json.loads(body)
+
+                    if "choices" in result and len(result["choices"]) > 0:
+                        assistant_message = result["choices"][0]["message"]
+                        response_text = assistant_message.get("content", "")
+
+                        await save_context(user_id, user_message, assistant_message)
+
+                        if response_text.strip():
+                            response_text = remove_details_tags(response_text)
+                            formatted_reply = process_latex(telegram_format(response_text))
+                            chunks = split_html(formatted_reply)
+
+                            for chunk in chunks:
+                                await message.reply(chunk, parse_mode="HTML")
+                        else:
+                            await message.reply(_("qwen_error"))
+                        return
+
+                    last_error = Exception("Empty response")
+                    if await qwen_retry.wait(attempt, max_attempts=max_retries):
+                        continue
+                    break
                                 
-                except aiohttp.ClientError as e:
+                except CircuitOpenError as e:
                     last_error = e
-                    await asyncio.sleep(1)
-                    continue
-                except asyncio.TimeoutError as e:
+                    break
+                except qwen_retry.retry_exceptions as e:
                     last_error = e
-                    await asyncio.sleep(1)
-                    continue
+                    qwen_pool.failure(current_key, detail=type(e).__name__)
+                    if await qwen_retry.wait(attempt, max_attempts=max_retries):
+                        continue
+                    break
                 except Exception as e:
                     last_error = e
-                    await asyncio.sleep(1)
-                    continue
+                    break
             
             error_msg = _("qwen_error")
             if last_error:
@@ -263,7 +271,7 @@ async def cmd_qwenrm(message: Message, bot: Bot):
     user_id = message.from_user.id
     user_language = message.from_user.language_code or DEFAULT_LANGUAGE
     _ = get_localization(user_language)
-    remove_messages(user_id)
+    await remove_messages(user_id)
     await message.reply(_("qwen_history_rm"))
 
 @router.message(Command("qwenimg", ignore_case=True))
@@ -291,11 +299,11 @@ async def cmd_qwenimg(message: Message, command: CommandObject, bot: Bot):
         qwen_keys = load_keys_from_env()
         max_retries = len(qwen_keys) * 2
         last_error = None
+        qwen_retry.start()
         
         for attempt in range(max_retries):
             try:
                 current_key = get_next_key()
-                headers = await get_headers_with_key(current_key)
                 
                 json_data = {
                     "prompt": user_input,
@@ -303,54 +311,54 @@ async def cmd_qwenimg(message: Message, command: CommandObject, bot: Bot):
                     "n": 1,
                 }
 
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        "https://qwen.aikit.club/v1/images/generations",
-                        headers=headers,
-                        json=json_data,
-                        timeout=120
-                    ) as response:
-                        
-                        if response.status == 400:
-                            error_data = await response.json()
-                            if error_data.get("error", {}).get("message") == "The chat is in progress!":
-                                await asyncio.sleep(1)
-                                continue
-                        
-                        if response.status != 200:
-                            error_text = await response.text()
-                            if response.status in [401, 403, 429, 500, 502, 503, 504]:
-                                await asyncio.sleep(1)
-                                continue
-                            else:
-                                raise Exception(f"Image generation failed: {response.status} - {error_text}")
-                        
-                        result = await response.json()
-                        
-                        if "data" in result and len(result["data"]) > 0:
-                            image_url = result["data"][0].get("url")
-                            
-                            if image_url:
-                                await safe_delete(sent_message)
-                                await message.reply_photo(photo=image_url)
-                            else:
-                                raise Exception("No image URL in response")
-                            return
-                        else:
-                            continue
+                status, body, delay = await post_qwen(
+                    "https://qwen.aikit.club/v1/images/generations", current_key, json_data, timeout=120
+                )
+
+                if status == 400 and _chat_in_progress(body):
+                    if await qwen_retry.wait(attempt, max_attempts=max_retries):
+                        continue
+                    break
+
+                if status in KEY_ROTATION_STATUSES:
+                    last_error = Exception(f"Image generation failed: {status} - {body}")
+                    continue
+
+                if status != 200:
+                    last_error = Exception(f"Image generation failed: {status} - {body}")
+                    if qwen_retry.is_retryable(status=status) and await qwen_retry.wait(attempt, delay, max_retries):
+                        continue
+                    break
+
+                result = json.loads(body)
+
+                if "data" in result and len(result["data"]) > 0:
+                    image_url = result["data"][0].get("url")
+
+                    if image_url:
+                        await safe_delete(sent_message)
+                        await message.reply_photo(photo=image_url)
+                    else:
+                        raise Exception("No image URL in response")
+                    return
+
+                last_error = Exception("Empty response")
+                if await qwen_retry.wait(attempt, max_attempts=max_retries):
+                    continue
+                break
                             
-            except aiohttp.ClientError as e:
+            except CircuitOpenError as e:
                 last_error = e
-                await asyncio.sleep(1)
-                continue
-            except asyncio.TimeoutError as e:
+                break
+            except qwen_retry.retry_exceptions as e:
                 last_error = e
-                await asyncio.sleep(1)
-                continue
+                qwen_pool.failure(current_key, detail=type(e).__name__)
+                if await qwen_retry.wait(attempt, max_attempts=max_retries):
+                    continue
+                break
             except Exception as e:
                 last_error = e
-                await asyncio.sleep(1)
-                continue
+                break
         
         await safe_delete(sent_message)
         error_msg = _("qwenimg_err")
@@ -10,7 +10,7 @@ from aiogram.filters import Command, CommandObject
 from utils.typing_indicator import TypingIndicator
 from localization import get_localization, DEFAULT_LANGUAGE
 from utils.command_states import check_command_enabled
-from aiohttp import ClientSession
+from utils.http_clients import http_session
 from handlers.callbacks import rate_limit
 
 router = Router()
@@ -57,7 +57,7 @@ async def get_sid():
                 pass
 
     if not sid:
-        async with ClientSession() as session:
+        async with http_session("rephrase") as session:
             async with session.get("https://translate.yandex.ru/editor",
                     params=params,
                     headers=headers) as resp:
@@ -129,7 +129,7 @@ async def on_action_callback(callback: CallbackQuery, bot: Bot):
         try:
             params["sid"] = await get_sid()
 
-            async with ClientSession() as session:
+            async with http_session("rephrase") as session:
                 async with session.post(
                     "https://translate.yandex.ru/editor/api/v1/transform-text",
                     params=params,
@@ -10,6 +10,7 @@ from localization import DEFAULT_LANGUAGE, get_localization
 from shazamio import Shazam
 from bs4 import BeautifulSoup
 import httpx
+from utils.http_clients import get_httpx_client
 
 router = Router()
 
@@ -54,12 +55,11 @@ async def get_localized_artist_name(url: str) -> str | None:
     }
     localized_url = url.replace("www.shazam.com/track", "www.shazam.com/ru-ru/track")
 
-    async with httpx.AsyncClient(follow_redirects=True, timeout=10) as client:
-        try:
-            response = await client.get(localized_url, headers=headers)
-            response.raise_for_status()
-        except (httpx.HTTPStatusError, httpx.RequestError):
-            return None
+    try:
+        response = await get_httpx_client("shazam").get(localized_url, headers=headers, timeout=10)
+        response.raise_for_status()
+    except (httpx.HTTPStatusError, httpx.RequestError):
+        return None
 
     soup = BeautifulSoup(response.text, 'html.parser')
 
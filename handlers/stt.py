@@ -1,10 +1,9 @@
-import aiohttp
 import asyncio
 import os
 import subprocess
 import json
 from io import BytesIO
-from aiohttp import TCPConnector, ClientTimeout
+from aiohttp import ClientTimeout
 
 from utils.typing_indicator import TypingIndicator
 from aiogram import Bot, Router, types
@@ -13,6 +12,10 @@ from aiogram.filters import Command
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from utils.command_states import check_command_enabled
 from localization import DEFAULT_LANGUAGE, get_localization
+from utils.http_clients import http_session
+from utils.circuit_breaker import get_breaker
+
+stt_breaker = get_breaker("stt", max_in_flight=10)
 
 API_URLS = [
     "https://router.huggingface.co/hf-inference/models/openai/whisper-large-v3-turbo"
@@ -51,36 +54,29 @@ async def process_audio(wav_buffer: BytesIO, message, api=0):
         _ = get_localization(user_language)
         wav_buffer.seek(0)
         
-        connector = TCPConnector(
-            limit=0,
-            limit_per_host=0,
-            force_close=True,
-            enable_cleanup_closed=True
-        )
-        
         timeout = ClientTimeout(total=300)
         
-        async with aiohttp.ClientSession(
-            connector=connector,
-            timeout=timeout
-        ) as session:
+        async with stt_breaker.call() as call, http_session("stt") as session:
             async with session.post(
                 API_URLS[api],
                 headers=headers,
-                data=wav_buffer.getvalue()
+                data=wav_buffer.getvalue(),
+                timeout=timeout
             ) as response:
+                if response.status >= 500:
+                    call.fail()
                 text = await response.text()
-                
-                if len(text) > 10000:
-                    loop = asyncio.get_event_loop()
-                    response_json = await loop.run_in_executor(
-                        None,
-                        lambda: json.loads(text)
-                    )
-                else:
-                    response_json = json.loads(text)
-                    
-                return response_json.get('text', _("voice_error"))
+
+        if len(text) > 10000:
+            loop = asyncio.get_event_loop()
+            response_json = await loop.run_in_executor(
+                None,
+                lambda: json.loads(text)
+            )
+        else:
+            response_json = json.loads(text)
+
+        return response_json.get('text', _("voice_error"))
     except Exception:
         return _("voice_error")
 
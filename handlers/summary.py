@@ -11,10 +11,13 @@ from aiogram.filters import Command, CommandObject
 from aiogram.types import Message
 from utils.command_states import check_command_enabled
 from localization import DEFAULT_LANGUAGE, get_localization
+from utils.http_clients import new_session
+from utils.circuit_breaker import CircuitOpenError, get_breaker
 
 router = Router()
 
 GEN_URL = "https://300.ya.ru/api/generation"
+summary_breaker = get_breaker("summary")
 
 class Yandex300API:
     def __init__(self):
@@ -48,12 +51,20 @@ class Yandex300API:
                 enable_cleanup_closed=True
             )
         
-        self.session = aiohttp.ClientSession(
-            headers=self.headers, 
-            cookies=self.cookies,
-            connector=connector,
-            timeout=aiohttp.ClientTimeout(total=120)
-        )
+        if connector is None:
+            self.session = new_session(
+                "summary",
+                headers=self.headers,
+                cookies=self.cookies,
+                timeout=aiohttp.ClientTimeout(total=120)
+            )
+        else:
+            self.session = aiohttp.ClientSession(
+                headers=self.headers, 
+                cookies=self.cookies,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=120)
+            )
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -61,9 +72,16 @@ class Yandex300API:
             await self.session.close()
 
     async def post(self, url, data):
-        async with self.session.post(url, json=data, allow_redirects=True) as response:
+        try:
+            call = summary_breaker.call()
+        except CircuitOpenError as e:
+            print(e)
+            return None
+        async with call, self.session.post(url, json=data, allow_redirects=True) as response:
             # Проверяем статус
             if response.status != 200:
+                if response.status >= 500:
+                    call.fail()
                 print(f"Status: {response.status}, URL: {response.url}")
                 return None
             return await response.json()
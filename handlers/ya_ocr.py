@@ -13,6 +13,7 @@ from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
 from utils.command_states import check_command_enabled
 
 from localization import DEFAULT_LANGUAGE, get_localization
+from utils.http_clients import http_session
 
 router = Router()
 
@@ -28,7 +29,7 @@ async def fetch_token():
     global iam_token, token_expiry_time
     async with token_lock:
         if time.time() > token_expiry_time:
-            async with aiohttp.ClientSession() as session:
+            async with http_session("yandex") as session:
                 async with session.post("https://iam.api.cloud.yandex.net/iam/v1/tokens", data=json.dumps({"yandexPassportOauthToken": os.getenv("YANDEX_OAUTH_TOKEN")})) as response:
                     response.raise_for_status()
                     token_data = await response.json()
@@ -49,7 +50,7 @@ async def do_ocr_request(file_id, bot):
         }
         try:
             token = await fetch_token()
-            async with aiohttp.ClientSession() as session:
+            async with http_session("yandex") as session:
                 async with session.post(url, data=json.dumps(curData), headers={"Authorization": "Bearer {}".format(token), "Content-Type": "application/json", "x-folder-id": os.getenv("FOLDER_ID")}) as response:
                     response.raise_for_status()
                     ocr_result = await response.json()
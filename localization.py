@@ -1,12 +1,19 @@
-
 import gettext
+from types import MappingProxyType
 #pybabel compile -d locales
 LOCALES_DIR = 'locales'
 DEFAULT_LANGUAGE = 'ru'
 LANGUAGES =  ['ru', 'uk', 'en', 'es']
 
+def load_catalogs(localedir=LOCALES_DIR):
+    # Read every .mo once; the bound gettext of each catalog is returned as
+    # is, without installing it into builtins.
+    return MappingProxyType({
+        lang: gettext.translation('messages', localedir=localedir, languages=[lang]).gettext
+        for lang in LANGUAGES
+    })
+
+CATALOGS = load_catalogs()
+
 def get_localization(language_code):
-    lang = language_code if language_code in LANGUAGES else DEFAULT_LANGUAGE
-    translation = gettext.translation('messages', localedir=LOCALES_DIR, languages=[lang])
-    translation.install()
-    return translation.gettext
+    return CATALOGS.get(language_code) or CATALOGS[DEFAULT_LANGUAGE]
@@ -1,30 +1,139 @@
-import time, os, asyncio
+import time, os, threading, uuid
 from aiogram import BaseMiddleware, Bot
 from aiogram.types import TelegramObject, Update
 from typing import Callable, Dict, Awaitable, Any
 from utils.dbmanager import DB
-from utils.cmd_list import cmds
 from localization import get_localization, DEFAULT_LANGUAGE
 
 ban_user_db, BanUserQuery = DB('db/banned_users.json').get_db()
 ban_chat_db, BanChatQuery = DB('db/banned_chats.json').get_db()
 
+BAN_CACHE_TTL = int(os.getenv("BAN_CACHE_TTL", 60))
+BAN_CHANNEL = "bans:invalidate"
+# Identifies this process on the invalidation channel, so it skips its
+# own messages (its sets are already up to date).
+_INSTANCE = uuid.uuid4().hex
+
+
+class BanSet:
+    # In-memory set of the banned ids in one table, so the per-update check
+    # is a set lookup instead of a DB query. Changes made in this process
+    # update the set directly; with the Redis backend they are also
+    # published on BAN_CHANNEL and other processes reload on their next
+    # check. On every backend the set is reloaded at least every
+    # BAN_CACHE_TTL seconds: that is how bans made by another process over
+    # a shared SQLite or JSON file show up, and it covers invalidations
+    # missed while the Redis subscription was down.
+    def __init__(self, table, field: str, name: str):
+        self.table = table
+        self.field = field
+        self.name = name
+        self._ids = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._shared = None
+
+    def _is_shared(self) -> bool:
+        if self._shared is None:
+            from utils.dbmanager import _backend
+            self._shared = _backend(local=False) == "redis"
+            if self._shared:
+                _subscribe()
+        return self._shared
+
+    def _load(self) -> set:
+        # The first load also subscribes to BAN_CHANNEL on Redis.
+        self._is_shared()
+        generation = self._generation
+        ids = {str(entry[self.field]) for entry in self.table.all() if entry.get(self.field) is not None}
+        with self._lock:
+            # An invalidation that arrived during the read wins: the next
+            # check reloads again.
+            if generation == self._generation:
+                self._ids = ids
+                self._loaded_at = time.monotonic()
+        return ids
+
+    def __contains__(self, value) -> bool:
+        ids = self._ids
+        if ids is None or time.monotonic() - self._loaded_at > BAN_CACHE_TTL:
+            ids = self._load()
+        return str(value) in ids
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._ids = None
+
+    def changed(self, value, banned: bool):
+        with self._lock:
+            if self._ids is not None:
+                ids = set(self._ids)
+                (ids.add if banned else ids.discard)(str(value))
+                self._ids = ids
+        if self._is_shared():
+            _publish(self.name)
+
+
+_ban_sets = {}
+_subscription = None
+_subscription_lock = threading.Lock()
+
+def _on_invalidate(message):
+    name, _, instance = str(message.get("data", "")).partition(":")
+    if instance != _INSTANCE and name in _ban_sets:
+        _ban_sets[name].invalidate()
+
+def _subscribe():
+    global _subscription
+    with _subscription_lock:
+        if _subscription is not None:
+            return
+        try:
+            from utils.TinyRedis import TinyRedisDB
+            pubsub = TinyRedisDB.connection().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{BAN_CHANNEL: _on_invalidate})
+            _subscription = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            print(f"Ошибка подписки на {BAN_CHANNEL}: {e}")
+
+def _publish(name: str):
+    try:
+        from utils.TinyRedis import TinyRedisDB
+        TinyRedisDB.connection().publish(BAN_CHANNEL, f"{name}:{_INSTANCE}")
+    except Exception as e:
+        print(f"Ошибка публикации в {BAN_CHANNEL}: {e}")
+
+
+banned_users = _ban_sets['users'] = BanSet(ban_user_db, 'uid', 'users')
+banned_chats = _ban_sets['chats'] = BanSet(ban_chat_db, 'cid', 'chats')
+
 def is_banned(user_id: int) -> bool:
     if str(user_id) == os.getenv("ADMIN_ID"):
         return False
-    return ban_user_db.get(BanUserQuery().uid == user_id) is not None
+    return user_id in banned_users
+
+def _upsert_ban(table, data: dict, query):
+    # A repeated ban keeps the time of the first one.
+    defaults = {'timestamp': time.time()}
+    if hasattr(table, "upsert_with_defaults"):
+        table.upsert_with_defaults(data, defaults, query)
+        return
+    entry = table.get(query) or defaults
+    table.upsert({**data, 'timestamp': entry.get('timestamp') or defaults['timestamp']}, query)
 
 def ban_user(user_id: int, username: str = None) -> None:
-    if not ban_user_db.contains(BanUserQuery().uid == user_id):
-        data = {
-            'uid': user_id,
-            'timestamp': time.time(),
-            **({'username': username} if username is not None else {})
-        }
-        ban_user_db.insert(data)
+    data = {
+        'uid': user_id,
+        **({'username': username} if username is not None else {})
+    }
+    _upsert_ban(ban_user_db, data, BanUserQuery().uid == user_id)
+    banned_users.changed(user_id, True)
 
 def unban_user(user_id: int) -> None:
     ban_user_db.remove(BanUserQuery().uid == user_id)
+    banned_users.changed(user_id, False)
 
 def get_banned_users() -> list:
     return [
@@ -33,18 +142,18 @@ def get_banned_users() -> list:
     ]
 
 def is_chat_banned(chat_id: int) -> bool:
-    return ban_chat_db.get(BanChatQuery().cid == chat_id) is not None
+    return chat_id in banned_chats
 
 def ban_chat(chat_id: int, chat_title: str = None) -> None:
-    if not ban_chat_db.contains(BanChatQuery().cid == chat_id):
-        ban_chat_db.insert({
-            'cid': chat_id,
-            'title': chat_title,
-            'timestamp': time.time()
-        })
+    _upsert_ban(ban_chat_db, {
+        'cid': chat_id,
+        'title': chat_title,
+    }, BanChatQuery().cid == chat_id)
+    banned_chats.changed(chat_id, True)
 
 def unban_chat(chat_id: int) -> None:
     ban_chat_db.remove(BanChatQuery().cid == chat_id)
+    banned_chats.changed(chat_id, False)
 
 def get_banned_chats() -> list:
     return [
@@ -56,12 +165,6 @@ class BanMiddleware(BaseMiddleware):
     def __init__(self, bot: Bot, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.bot = bot
-        self.botname = None
-        asyncio.create_task(self.init())
-
-    async def init(self):
-        bot_info = await self.bot.get_me()
-        self.botname = bot_info.username
 
     async def __call__(
         self, 
@@ -69,12 +172,18 @@ class BanMiddleware(BaseMiddleware):
         event: TelegramObject, 
         data: Dict[str, Any]
     ) -> Any:
+        if data.get("update_path") in ("reply_to_bot", "album", "other"):
+            # Group messages that are not commands are never ban-checked.
+            return await handler(event, data)
+
         user_id = None
         chat_id = None
 
         if isinstance(event, Update):
-            user_id = self._extract_user_id(event)
-            chat_id = self._extract_chat_info(event)
+            parsed = data.get("parsed_command")
+            is_command = parsed is not None and parsed.is_ours
+            user_id = self._extract_user_id(event, is_command)
+            chat_id = self._extract_chat_info(event, is_command)
 
         if user_id and is_banned(user_id):
             user_language = self._get_user_language_code(event) or DEFAULT_LANGUAGE
@@ -104,33 +213,17 @@ class BanMiddleware(BaseMiddleware):
 
         return await handler(event, data)
 
-    def _extract_user_id(self, event: Update) -> int | None:
+    def _extract_user_id(self, event: Update, is_command: bool) -> int | None:
         if event.message and event.message.from_user:
-            message_text = event.message.text or event.message.caption
-
-            if (
-                event.message.chat.type == 'private' or 
-                (message_text and any( 
-                    message_text == cmd or
-                    message_text.startswith(cmd + ' ') or 
-                    message_text.startswith(f"{cmd}@{self.botname}")
-                for cmd in cmds))
-            ):
+            if event.message.chat.type == 'private' or is_command:
                 return event.message.from_user.id
         elif event.callback_query and event.callback_query.from_user:
             return event.callback_query.from_user.id
         return None
 
-    def _extract_chat_info(self, event: Update) -> int | None:
+    def _extract_chat_info(self, event: Update, is_command: bool) -> int | None:
         if event.message and event.message.chat:
-            message_text = event.message.text or event.message.caption
-            if (
-                message_text and any(
-                    message_text == cmd or
-                    message_text.startswith(cmd + ' ') or
-                    message_text.startswith(f"{cmd}@{self.botname}")
-                for cmd in cmds)
-            ):
+            if is_command:
                 return event.message.chat.id
         elif event.callback_query and event.callback_query.message and event.callback_query.message.chat:
             return event.callback_query.message.chat.id
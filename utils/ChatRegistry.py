@@ -0,0 +1,95 @@
+import threading
+import time
+
+# last_seen is only written back when it moved by more than this, so an
+# active chat costs one DB write per interval rather than one per message.
+LAST_SEEN_RESOLUTION = 3600
+
+
+class ChatRegistry:
+    # Every chat the bot has seen, kept in memory and loaded from the chats
+    # table on first use. seen() is a dict lookup; new chats, title changes
+    # and stale last_seen values are queued and written by flush().
+    def __init__(self, table, query_cls):
+        self.table = table
+        self.Query = query_cls
+        self._chats = None
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._chats is not None:
+            return self._chats
+        with self._lock:
+            if self._chats is None:
+                chats = {}
+                for record in self.table:
+                    if record.get('chat_id') is None:
+                        continue
+                    # The Redis backend returns every field as a string.
+                    last_seen = float(record.get('last_seen') or 0)
+                    chats[str(record['chat_id'])] = {
+                        'chat_title': record.get('chat_title'),
+                        'last_seen': last_seen or None,
+                        'saved_seen': last_seen,
+                    }
+                self._chats = chats
+        return self._chats
+
+    def seen(self, chat_id: str, chat_title: str):
+        chats = self._load()
+        now = time.time()
+        chat = chats.get(chat_id)
+        if chat is None:
+            with self._lock:
+                chats[chat_id] = {'chat_title': chat_title, 'last_seen': now, 'saved_seen': 0}
+                self._dirty.add(chat_id)
+            return
+        chat['last_seen'] = now
+        if chat['chat_title'] != chat_title or now - chat['saved_seen'] > LAST_SEEN_RESOLUTION:
+            with self._lock:
+                chat['chat_title'] = chat_title
+                self._dirty.add(chat_id)
+
+    def flush(self):
+        # A reset() during the flush drops the rest of the batch.
+        with self._lock:
+            chats = self._chats
+            if not self._dirty or chats is None:
+                return
+            dirty, self._dirty = self._dirty, set()
+            records = [(chat_id, dict(chats[chat_id])) for chat_id in dirty if chat_id in chats]
+        failed = []
+        for chat_id, chat in records:
+            if self._chats is not chats:
+                return
+            try:
+                self.table.upsert(
+                    {'chat_id': chat_id, 'chat_title': chat['chat_title'], 'last_seen': chat['last_seen']},
+                    self.Query().chat_id == chat_id,
+                )
+                chats[chat_id]['saved_seen'] = chat['last_seen']
+            except Exception as e:
+                print(f"Ошибка сохранения чата {chat_id}: {e}")
+                failed.append(chat_id)
+        if failed:
+            with self._lock:
+                if self._chats is chats:
+                    self._dirty.update(failed)
+
+    def reset(self):
+        with self._lock:
+            self._chats = None
+            self._dirty = set()
+
+    def __len__(self):
+        return len(self._load())
+
+    def page(self, number: int, size: int) -> list:
+        # Most recently active first; chats never seen since last_seen was
+        # introduced sort last.
+        chats = sorted(self._load().items(), key=lambda item: item[1]['last_seen'] or 0, reverse=True)
+        return [
+            {'chat_id': chat_id, 'chat_title': chat['chat_title'], 'last_seen': chat['last_seen']}
+            for chat_id, chat in chats[number * size:(number + 1) * size]
+        ]
@@ -0,0 +1,56 @@
+import re
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from utils.cmd_list import cmds
+
+COMMAND_PATTERN = re.compile(r"/([^\s@]+)(?:@(\w+))?(?:\s+(.*))?", re.DOTALL)
+KNOWN_COMMANDS = frozenset(cmds)
+
+
+class ParsedCommand(NamedTuple):
+    command: str                # lower-cased, with the leading slash: "/gpt"
+    mention: Optional[str]      # "name" from "/gpt@name", if any
+    args: Optional[str]
+    for_bot: bool               # no mention, or the mention is this bot
+    known: bool                 # one of cmd_list.cmds
+
+    @property
+    def is_ours(self) -> bool:
+        return self.known and self.for_bot
+
+
+def parse_command(text: Optional[str], bot_username: Optional[str]) -> Optional[ParsedCommand]:
+    if not text or text[0] != "/":
+        return None
+    match = COMMAND_PATTERN.match(text)
+    if match is None:
+        return None
+    name, mention, args = match.groups()
+    command = "/" + name.lower()
+    for_bot = mention is None or (bot_username is not None and mention.lower() == bot_username.lower())
+    return ParsedCommand(command, mention, args, for_bot, command in KNOWN_COMMANDS)
+
+
+class CommandMiddleware(BaseMiddleware):
+    # Outer update middleware: parses the command of a message (text or
+    # caption) once per update and stores it in data["parsed_command"]
+    # (None for anything that is not a command) for the middlewares and
+    # handlers that run after it. The bot's username comes from Bot.me(),
+    # which calls getMe once per process and caches the result.
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        parsed = None
+        message = event.message if isinstance(event, Update) else None
+        if message:
+            text = message.text or message.caption
+            if text and text[0] == "/":
+                bot = data.get("bot")
+                bot_username = (await bot.me()).username if bot else None
+                parsed = parse_command(text, bot_username)
+        data["parsed_command"] = parsed
+        return await handler(event, data)
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from utils.context_codec import encode_messages, decode_messages
+
+MAX_MESSAGES = 100
+
+
+class RedisConversationStore:
+    # One Redis list per user: a turn is a single RPUSH + LTRIM + EXPIRE
+    # pipeline and a read is a single LRANGE of the last max_messages.
+    def __init__(self, name: str, ttl: int, max_messages: int = MAX_MESSAGES):
+        from utils.TinyRedis import AsyncTinyRedisDB
+        self.name = name
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.redis = AsyncTinyRedisDB.connection()
+
+    def _key(self, uid):
+        return f"{self.name}:conv:{uid}"
+
+    async def load(self, uid) -> list:
+        return [decode_messages(item) for item in await self.redis.lrange(self._key(uid), -self.max_messages, -1)]
+
+    async def append(self, uid, *messages):
+        key = self._key(uid)
+        pipe = self.redis.pipeline()
+        pipe.rpush(key, *(encode_messages(message) for message in messages))
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def clear(self, uid):
+        await self.redis.delete(self._key(uid))
+
+
+class SQLiteConversationStore:
+    # One row per message; a conversation expires once its last message
+    # is older than ttl.
+    def __init__(self, name: str, ttl: int, max_messages: int = MAX_MESSAGES):
+        from utils.TinySQLite import TinySQLiteDB, SQLITE_PATH
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.table = "conv_" + re.sub(r"\W", "_", name)
+        self.conn, self._lock = TinySQLiteDB._connect(SQLITE_PATH)
+        with self._lock:
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                f"(id INTEGER PRIMARY KEY AUTOINCREMENT, uid TEXT NOT NULL, t REAL NOT NULL, m TEXT NOT NULL)"
+            )
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_uid ON {self.table} (uid, id)")
+
+    def _load(self, uid) -> list:
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT t, m FROM {self.table} WHERE uid = ? ORDER BY id DESC LIMIT ?", (str(uid), self.max_messages)
+            ).fetchall()
+        if not rows or time.time() - rows[0][0] >= self.ttl:
+            return []
+        return [json.loads(m) for _, m in reversed(rows)]
+
+    def _append(self, uid, messages):
+        uid, now = str(uid), time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # An expired conversation starts over.
+                self.conn.execute(
+                    f"DELETE FROM {self.table} WHERE uid = ? AND "
+                    f"(SELECT MAX(t) FROM {self.table} WHERE uid = ?) < ?",
+                    (uid, uid, now - self.ttl),
+                )
+                self.conn.executemany(
+                    f"INSERT INTO {self.table} (uid, t, m) VALUES (?, ?, ?)",
+                    [(uid, now, json.dumps(message, ensure_ascii=False)) for message in messages],
+                )
+                self.conn.execute(
+                    f"DELETE FROM {self.table} WHERE uid = ? AND id <= "
+                    f"(SELECT id FROM {self.table} WHERE uid = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (uid, uid, self.max_messages),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _clear(self, uid):
+        with self._lock:
+            self.conn.execute(f"DELETE FROM {self.table} WHERE uid = ?", (str(uid),))
+
+    async def load(self, uid) -> list:
+        return await asyncio.to_thread(self._load, uid)
+
+    async def append(self, uid, *messages):
+        await asyncio.to_thread(self._append, uid, messages)
+
+    async def clear(self, uid):
+        await asyncio.to_thread(self._clear, uid)
+
+    def compact(self):
+        with self._lock:
+            self.conn.execute(
+                f"DELETE FROM {self.table} WHERE uid IN "
+                f"(SELECT uid FROM {self.table} GROUP BY uid HAVING MAX(t) < ?)",
+                (time.time() - self.ttl,),
+            )
+
+
+class FileConversationStore:
+    # Append-only <name>.log, replayed on first use; a clear is a
+    # tombstone line and compact() rewrites the log.
+    def __init__(self, name: str, ttl: int, max_messages: int = MAX_MESSAGES):
+        self.path = f"{name}.log"
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._conversations = None
+        self._handle = None
+        self._lines = 0
+
+    def _load(self):
+        if self._conversations is not None:
+            return
+        self._conversations = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._apply(entry)
+                    self._lines += 1
+        self._handle = open(self.path, "a", encoding="utf-8")
+
+    def _apply(self, entry):
+        uid = str(entry["u"])
+        if entry.get("c"):
+            self._conversations.pop(uid, None)
+            return
+        conversation = self._conversations.get(uid)
+        if conversation is None:
+            conversation = self._conversations[uid] = {"t": 0, "m": deque(maxlen=self.max_messages)}
+        conversation["t"] = entry["t"]
+        conversation["m"].append(entry["m"])
+
+    def _write(self, entries):
+        for entry in entries:
+            self._apply(entry)
+        self._handle.write("".join(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n" for entry in entries))
+        self._handle.flush()
+        self._lines += len(entries)
+
+    def _live(self, conversation, now):
+        return conversation is not None and now - conversation["t"] < self.ttl
+
+    def _read(self, uid) -> list:
+        with self._lock:
+            self._load()
+            conversation = self._conversations.get(str(uid))
+            if not self._live(conversation, time.time()):
+                return []
+            return list(conversation["m"])
+
+    def _append(self, uid, messages):
+        now = time.time()
+        entries = [{"u": uid, "t": now, "m": message} for message in messages]
+        with self._lock:
+            self._load()
+            conversation = self._conversations.get(str(uid))
+            if conversation is not None and not self._live(conversation, now):
+                # Start a new conversation on replay too, not just in memory.
+                entries.insert(0, {"u": uid, "t": now, "c": 1})
+            self._write(entries)
+
+    def _clear(self, uid):
+        with self._lock:
+            self._load()
+            if str(uid) in self._conversations:
+                self._write([{"u": uid, "t": time.time(), "c": 1}])
+
+    async def load(self, uid) -> list:
+        return await asyncio.to_thread(self._read, uid)
+
+    async def append(self, uid, *messages):
+        await asyncio.to_thread(self._append, uid, messages)
+
+    async def clear(self, uid):
+        await asyncio.to_thread(self._clear, uid)
+
+    def compact(self):
+        with self._lock:
+            self._load()
+            now = time.time()
+            for uid in [uid for uid, c in self._conversations.items() if not self._live(c, now)]:
+                del self._conversations[uid]
+            live = sum(len(c["m"]) for c in self._conversations.values())
+            if self._lines <= live:
+                return
+            directory = os.path.dirname(self.path) or "."
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".log")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    for uid, conversation in self._conversations.items():
+                        for message in conversation["m"]:
+                            f.write(json.dumps({"u": uid, "t": conversation["t"], "m": message}, ensure_ascii=False, separators=(",", ":")) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._handle.close()
+                os.replace(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            finally:
+                if self._handle.closed:
+                    self._handle = open(self.path, "a", encoding="utf-8")
+            self._lines = live
+
+
+def _legacy_dropper(name: str, backend: str):
+    # Removes the old <name>.json context table once, from the sweeper.
+    path = f"{name}.json"
+    marker = f"legacy_dropped:{path}"
+    done = False
+
+    def drop():
+        nonlocal done
+        if done:
+            return
+        if backend == "redis":
+            from utils.TinyRedis import TinyRedisDB
+            redis = TinyRedisDB.connection()
+            if not redis.exists(marker):
+                TinyRedisDB(db_name=path)._delete_matching(f"{path}:*")
+                redis.set(marker, 1)
+        else:
+            if backend == "sqlite":
+                from utils.TinySQLite import drop_table
+                drop_table(path)
+            if os.path.exists(path):
+                os.remove(path)
+        done = True
+    return drop
+
+
+def open_conversations(name: str, ttl: int, max_messages: int = MAX_MESSAGES):
+    from utils.dbmanager import _backend, register_sweeper
+    backend = _backend(local=False)
+    register_sweeper(_legacy_dropper(name, backend))
+    if backend == "redis":
+        return RedisConversationStore(name, ttl, max_messages)
+    if backend == "sqlite":
+        store = SQLiteConversationStore(name, ttl, max_messages)
+    else:
+        store = FileConversationStore(name, ttl, max_messages)
+    register_sweeper(store.compact)
+    return store
@@ -0,0 +1,53 @@
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+PATHS = ("command", "callback", "private", "reply_to_bot", "album", "other")
+# How many updates took each path since start, for /uptime.
+path_counts = Counter({path: 0 for path in PATHS})
+
+
+def classify(update: Update, parsed_command, bot_id: int) -> str:
+    message = update.message
+    if message is None:
+        return "callback" if update.callback_query else "other"
+    if parsed_command is not None and parsed_command.for_bot:
+        return "command"
+    if message.chat.type == "private":
+        return "private"
+    if message.media_group_id:
+        return "album"
+    reply = message.reply_to_message
+    if reply and reply.from_user and reply.from_user.id == bot_id:
+        return "reply_to_bot"
+    return "other"
+
+
+class PrefilterMiddleware(BaseMiddleware):
+    # Outer update middleware, registered after CommandMiddleware: sorts
+    # each update into one of PATHS using only fields already on the update
+    # and stores it in data["update_path"]. The inner middlewares skip their
+    # DB and regex work for "other", i.e. group chatter that is none of a
+    # command, a reply to the bot or part of an album.
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        path = "other"
+        if isinstance(event, Update):
+            bot = data.get("bot")
+            path = classify(event, data.get("parsed_command"), bot.id if bot else None)
+        path_counts[path] += 1
+        data["update_path"] = path
+        return await handler(event, data)
+
+
+def format_path_counts() -> str:
+    total = sum(path_counts.values()) or 1
+    return "\n".join(
+        f" {'└─' if i == len(PATHS) - 1 else '├─'} {path}: {path_counts[path]} ({path_counts[path] * 100 / total:.1f}%)"
+        for i, path in enumerate(PATHS)
+    )
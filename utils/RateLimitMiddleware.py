@@ -1,42 +1,33 @@
 from aiogram import BaseMiddleware
 from aiogram.dispatcher.flags import get_flag
 from aiogram.types import Message, CallbackQuery, Update
-import asyncio
+from utils.RateLimiter import TokenBucket, message_limiter
 from localization import get_localization, DEFAULT_LANGUAGE
 
 class RateLimitMiddleware(BaseMiddleware):
-    def __init__(self, default_rate_limit: float = 1.0):
+    def __init__(self, default_rate_limit: float = 1.0, limiter: TokenBucket = message_limiter):
         self.default_rate_limit = default_rate_limit
-        self.user_times = {}
-        self.notified_users = set()
+        self.limiter = limiter
 
     async def __call__(self, handler, event, data):
         user_id = event.from_user.id
-        user_language = self._get_user_language_code(event) or DEFAULT_LANGUAGE
-        _ = get_localization(user_language)
-        current_time = asyncio.get_event_loop().time()
-
         rate_limit = get_flag(data, "ratelimit") or self.default_rate_limit
 
-        if user_id in self.user_times:
-            last_time = self.user_times[user_id]
-            if current_time - last_time < rate_limit:
-                if user_id not in self.notified_users:
-                    self.notified_users.add(user_id)
-                    message = None
-                    if isinstance(event, Message):
-                        message = event
-                    elif isinstance(event, CallbackQuery) and event.message:
-                        message = event.message
-                    
-                    if message:
-                        await message.answer(_("slowly"))
-                return
-            else:
-                if user_id in self.notified_users:
-                    self.notified_users.remove(user_id)
+        decision = await self.limiter.hit(user_id, rate_limit)
+        if not decision.allowed:
+            if decision.notify:
+                message = None
+                if isinstance(event, Message):
+                    message = event
+                elif isinstance(event, CallbackQuery) and event.message:
+                    message = event.message
+
+                if message:
+                    user_language = self._get_user_language_code(event) or DEFAULT_LANGUAGE
+                    _ = get_localization(user_language)
+                    await message.answer(_("slowly"))
+            return
 
-        self.user_times[user_id] = current_time
         return await handler(event, data)
 
     def _get_user_language_code(self, event: Update) -> str | None:
@@ -0,0 +1,96 @@
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 10000))
+
+# TokenBucket.hit() on the Redis clock. KEYS[1]: bucket; ARGV: interval, burst.
+TOKEN_BUCKET_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'notified')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+local notified = state[3] == '1'
+tokens = math.min(burst, tokens + (now - ts) / interval)
+local allowed, retry_after, notify = 0, 0, 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+    notified = false
+else
+    retry_after = (1 - tokens) * interval
+    if not notified then
+        notify = 1
+        notified = true
+    end
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now), 'notified', notified and '1' or '0')
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) * interval * 1000) + 1000)
+return {allowed, tostring(retry_after), notify}
+"""
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    retry_after: float      # seconds until the next request is allowed
+    notify: bool            # first refusal since the last allowed request
+
+
+class TokenBucket:
+    # Per-key token buckets of `burst` requests, one regained every
+    # `interval` seconds; only the max_keys most recent keys are kept.
+    def __init__(self, name: str, burst: int = 1, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._script = None
+        self._redis = None
+
+    def _use_redis(self) -> bool:
+        if self._redis is None:
+            from utils.dbmanager import _backend
+            self._redis = _backend(local=False) == "redis"
+            if self._redis:
+                from utils.TinyRedis import AsyncTinyRedisDB
+                self._script = AsyncTinyRedisDB.connection().register_script(TOKEN_BUCKET_SCRIPT)
+        return self._redis
+
+    def _hit_local(self, key, interval: float) -> Decision:
+        now = time.monotonic()
+        tokens, updated_at, notified = self._buckets.pop(key, (self.burst, now, False))
+        tokens = min(self.burst, tokens + (now - updated_at) / interval)
+        if tokens >= 1:
+            decision = Decision(True, 0.0, False)
+            tokens -= 1
+            notified = False
+        else:
+            decision = Decision(False, (1 - tokens) * interval, not notified)
+            notified = True
+        if tokens < self.burst:
+            self._buckets[key] = (tokens, now, notified)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return decision
+
+    async def hit(self, key, interval: float) -> Decision:
+        if self._use_redis():
+            try:
+                allowed, retry_after, notify = await self._script(
+                    keys=[f"{self.name}:{key}"], args=[interval, self.burst]
+                )
+                return Decision(bool(int(allowed)), float(retry_after), bool(int(notify)))
+            except Exception as e:
+                print(f"Ошибка ограничителя {self.name}: {e}")
+        return self._hit_local(key, interval)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+message_limiter = TokenBucket("ratelimit:message")
+callback_limiter = TokenBucket("ratelimit:callback")
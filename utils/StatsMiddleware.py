@@ -1,126 +1,276 @@
-import re 
-from datetime import datetime, timedelta
+from collections import Counter, defaultdict
+from datetime import date as Date, datetime, timedelta
 from typing import Any, Callable, Dict, Awaitable, Optional, Tuple
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
-import pytz, asyncio, aiohttp
+import pytz, asyncio, os, threading
 from utils.dbmanager import DB
 from utils.cmd_list import cmds
+from utils.mushrooms import has_mushroom, send_mushroom
+from utils.ChatRegistry import ChatRegistry
 
 db, Query = DB('db/stats.json').get_db()
 chats_db, ChatsQuery = DB('db/chats.json').get_db()
+# Precomputed sums over the daily records in db: one record per ISO week
+# ("W2024-05"), per month ("M2024-01") and a running "total", all kept in
+# step with the daily counters by flush_stats(). The "total" record also
+# holds the first date with stats under "since".
+rollup_db, RollupQuery = DB('db/stats_rollup.json').get_db()
+chat_registry = ChatRegistry(chats_db, ChatsQuery)
 
 moscow_tz = pytz.timezone('Europe/Moscow')
 
+STATS_FLUSH_INTERVAL = int(os.getenv("STATS_FLUSH_INTERVAL", 5))
+# Command counters not yet written to the stats table, per date.
+_pending = defaultdict(Counter)
+
 class StatsMiddleware(BaseMiddleware):
     def __init__(self, bot: str = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.bot = bot
-        self.text = None
-        asyncio.create_task(self.init())    
-
-    async def init(self):
-        bot_info = await self.bot.get_me()
-        self.text = bot_info.username
+        start_flush_loop()
 
     async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], event: TelegramObject, data: Dict[str, Any]) -> Any:        
-        pattern = r'[@\s]+' + re.escape(self.text) + r'\b'
-        cmd = (lambda t: re.split(pattern, t, 1)[0].split(' ')[0] if t else None)(event.message.text if event.message else None) or \
-              (lambda c: re.split(pattern, c, 1)[0].split(' ')[0] if c else None)(event.message.caption if event.message else None)
-        if cmd:
-            if cmd.lower() in cmds:
-                save_stats(cmd.lower())
+        parsed = data.get("parsed_command")
+        if parsed is not None and parsed.is_ours:
+            save_stats(parsed.command)
         if event.message:
             chat_id = str(event.message.chat.id)
             chat_title = event.message.chat.title or event.message.chat.username or f"Chat {chat_id}"
             save_chat(chat_id, chat_title)
+            if data.get("update_path") == "other" and not (event.message.text or event.message.caption):
+                return await handler(event, data)
             text_to_check = (event.message.text or "") + " " + (event.message.caption or "")
-
-            norm_text = (text_to_check or "").lower()
-            norm_text = (
-                norm_text.replace("і", "i")
-                        .replace("ї", "i")
-                        .replace("ј", "j")
-                        .replace("0", "o")
-                        .replace("1", "l")
-                        .replace("ß", "ss")
-            )
-
-            keywords = [
-                "гриб", "грiб", "грыб",
-                "grib", "gryb", "hrib",
-                "mushroom", "mashroom", "muschroom",
-                "pilz", "champignon",
-                "champignon", "fungo", "seta", "hongos", "champiñon",
-                "grzyb", "hřib", "huby", "печурка"
-            ]
-
-            if any(re.search(rf"{kw}", norm_text, re.IGNORECASE) for kw in keywords):
-                async with aiohttp.ClientSession() as session:
-                    async with session.get("https://toxicshrooms.vercel.app/api/mushrooms/randompic") as resp:
-                        if resp.status == 200:
-                            image_url = await resp.text()
-                            await self.bot.send_photo(chat_id, image_url.strip())
+            if has_mushroom(text_to_check):
+                send_mushroom(self.bot, chat_id)
         return await handler(event, data)
 
 def save_chat(chat_id: str, chat_title: str):
-    global chats_db, ChatsQuery
-    chats_db, ChatsQuery = DB('db/chats.json').get_db()
+    chat_registry.seen(chat_id, chat_title)
 
-    if not chats_db.search(ChatsQuery().chat_id == chat_id):
-        chats_db.insert({'chat_id': chat_id, 'chat_title': chat_title})
+def get_chats_page(page: int, size: int) -> Tuple[list, int]:
+    return chat_registry.page(page, size), len(chat_registry)
 
+def save_stats(cmd: str):
+    _pending[str(datetime.now(moscow_tz).date())][cmd] += 1
 
-def get_all_chats():
-    return chats_db.all()
+def _increment(table, query_cls, key: str, counters: Counter):
+    stats_query = query_cls().date == key
+    if hasattr(table, "increment"):
+        table.increment(dict(counters), stats_query)
+        return
+    record = table.get(stats_query)
+    if record is None:
+        table.insert({'date': key, **counters})
+    else:
+        table.update({cmd: int(record.get(cmd, 0) or 0) + n for cmd, n in counters.items()}, stats_query)
 
-def save_stats(cmd: str):
-    global db, Query
-    db, Query = DB('db/stats.json').get_db()
+def _week_key(day: Date) -> str:
+    year, week, _ = day.isocalendar()
+    return f"W{year}-{week:02d}"
 
-    current_datetime = datetime.now(moscow_tz)
-    stats_query = Query()
-    result = db.search(stats_query.date == str(current_datetime.date()))
+def _month_key(day: Date) -> str:
+    return f"M{day.year}-{day.month:02d}"
 
-    if not result:
-        stats_data = {cmd_name: 0 for cmd_name in cmds}
-        stats_data[cmd] = 1
-        db.insert({'date': str(current_datetime.date()), **stats_data})
-    else:
-        stats_data = result[0]
-        stats_data[cmd] = int(stats_data.get(cmd, 0)) + 1
-        db.update(stats_data, stats_query.date == str(current_datetime.date()))
+def _rollup_keys(day: Date):
+    return _week_key(day), _month_key(day), "total"
+
+_rollups_ready = False
+_since = None
+
+def _ensure_rollups():
+    # Stats written before rollups existed are summed into them once; after
+    # that the "total" record exists and every flush keeps them current.
+    global _rollups_ready
+    if _rollups_ready:
+        return
+    if rollup_db.get(RollupQuery().date == "total") is None:
+        rollups = defaultdict(Counter)
+        since = None
+        for stats_record in db:
+            try:
+                day = Date.fromisoformat(stats_record["date"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            counters = Counter({cmd: int(stats_record.get(cmd, 0) or 0) for cmd in cmds})
+            for key in _rollup_keys(day):
+                rollups[key].update(counters)
+            if since is None or stats_record["date"] < since:
+                since = stats_record["date"]
+        rollup_db.truncate()
+        for key, counters in rollups.items():
+            rollup_db.insert({'date': key, **counters})
+        if since is not None:
+            rollup_db.upsert({'since': since}, RollupQuery().date == "total")
+    _rollups_ready = True
+
+# Batches that were only partly written, as (date, counters, targets not
+# written yet); the next flush retries just those targets, so no counter
+# is added twice.
+_unapplied = []
+
+def _targets(date: str) -> list:
+    return [(db, Query, date)] + [
+        (rollup_db, RollupQuery, key) for key in _rollup_keys(Date.fromisoformat(date))
+    ]
+
+def _merge_counters(date: str, counters: Counter, targets: list):
+    while targets:
+        table, query_cls, key = targets[0]
+        _increment(table, query_cls, key, counters)
+        targets.pop(0)
+    global _since
+    if _since is None:
+        _since = (rollup_db.get(RollupQuery().date == "total") or {}).get('since') or ""
+    if not _since or date < _since:
+        rollup_db.upsert({'since': date}, RollupQuery().date == "total")
+        _since = date
+
+def _take_pending() -> list:
+    # Runs on the event loop, where save_stats() adds to _pending.
+    global _pending
+    pending, _pending = _pending, defaultdict(Counter)
+    batches = _unapplied[:] + [(date, counters, _targets(date)) for date, counters in pending.items()]
+    _unapplied.clear()
+    return batches
+
+_write_lock = threading.Lock()
+
+def _write_stats(batches: list):
+    # Also writes out the queued chat registry changes. Runs in a worker
+    # thread; the lock keeps a shutdown flush from overlapping a loop one.
+    with _write_lock:
+        chat_registry.flush()
+        if not batches:
+            return
+        try:
+            _ensure_rollups()
+        except Exception as e:
+            print(f"Ошибка сохранения статистики: {e}")
+            _unapplied.extend(batches)
+            return
+        for date, counters, targets in batches:
+            try:
+                _merge_counters(date, counters, targets)
+            except Exception as e:
+                print(f"Ошибка сохранения статистики: {e}")
+                _unapplied.append((date, counters, targets))
+
+def flush_stats():
+    _write_stats(_take_pending())
+
+def reset_stats():
+    # /trunc stats: empties the daily and rollup tables and forgets what
+    # was queued for them.
+    global _rollups_ready, _since
+    with _write_lock:
+        db.truncate()
+        rollup_db.truncate()
+        _pending.clear()
+        _unapplied.clear()
+        _rollups_ready = False
+        _since = None
+
+def reset_rollups():
+    # /trunc stats_rollup: the rollups are rebuilt from the daily records
+    # on next use, so queued rollup writes are dropped.
+    global _rollups_ready, _since
+    with _write_lock:
+        rollup_db.truncate()
+        _unapplied[:] = [
+            (date, counters, [target for target in targets if target[0] is db])
+            for date, counters, targets in _unapplied
+            if any(target[0] is db for target in targets)
+        ]
+        _rollups_ready = False
+        _since = None
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(_write_stats, _take_pending())
+        except Exception as e:
+            print(f"Ошибка сохранения статистики: {e}")
+
+_flush_task = None
+
+def start_flush_loop():
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_loop())
+    return _flush_task
+
+async def stop_flush_loop():
+    # Registered on dispatcher shutdown: the last flush has to reach the
+    # tables before the write-behind storages are flushed at exit.
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    await asyncio.to_thread(flush_stats)
+
+def _range_buckets(start: Date, end: Date):
+    # Covers [start, end] with the fewest records: whole months, then whole
+    # ISO weeks, then single days at the edges.
+    day = start
+    while day <= end:
+        next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        if day.day == 1 and next_month - timedelta(days=1) <= end:
+            yield rollup_db, RollupQuery, _month_key(day)
+            day = next_month
+        elif day.weekday() == 0 and day + timedelta(days=6) <= end:
+            yield rollup_db, RollupQuery, _week_key(day)
+            day += timedelta(days=7)
+        else:
+            yield db, Query, str(day)
+            day += timedelta(days=1)
 
-        
 def get_stats(start_date: Optional[str] = None, end_date: Optional[str] = None) -> Tuple[Optional[str], Dict[str, int], Dict[str, int], Optional[str]]:
-    total_stats = {cmd: 0 for cmd in cmds}  
     selected_stats = {cmd: 0 for cmd in cmds}  
-    earliest_date = None
+    today = datetime.now(moscow_tz).date()
 
     if start_date == "yesterday":
-        start_date = (datetime.now(moscow_tz) - timedelta(days=1)).strftime("%Y-%m-%d")
+        start_date = str(today - timedelta(days=1))
         end_date = start_date
 
     if start_date is None:
-        start_date = str(datetime.now(moscow_tz).date())
+        start_date = str(today)
     if end_date is None:
-        end_date = str(datetime.now(moscow_tz).date())
-
-    all_records = db.all()
-    
-    all_dates = [datetime.strptime(record.get("date", ""), "%Y-%m-%d").date() for record in all_records if "date" in record]
-    if all_dates:
-        earliest_date = str(min(all_dates))  
-
-    for stats_record in all_records:
-        record_date = datetime.strptime(stats_record.get("date", ""), "%Y-%m-%d").date()
-        
-        if start_date <= str(record_date) <= end_date:
+        end_date = str(today)
+
+    _ensure_rollups()
+    total = rollup_db.get(RollupQuery().date == "total") or {}
+    total_stats = {cmd: int(total.get(cmd, 0) or 0) for cmd in cmds}
+    earliest_date = total.get('since')
+
+    try:
+        start, end = Date.fromisoformat(start_date), Date.fromisoformat(end_date)
+    except ValueError:
+        start, end = None, None
+    if start is not None:
+        # Nothing is recorded before the first stats date or after today.
+        if earliest_date:
+            start = max(start, Date.fromisoformat(earliest_date))
+        for table, query_cls, key in _range_buckets(start, min(end, today)):
+            stats_record = table.get(query_cls().date == key)
+            if stats_record is None:
+                continue
             for cmd in cmds:
                 selected_stats[cmd] += int(stats_record.get(cmd, 0) or 0)
 
-        for cmd in cmds:
-            total_stats[cmd] += int(stats_record.get(cmd, 0) or 0)
+    for record_date, counters in list(_pending.items()):
+        if earliest_date is None or record_date < earliest_date:
+            earliest_date = record_date
+        for cmd, n in counters.items():
+            if cmd not in total_stats:
+                continue
+            total_stats[cmd] += n
+            if start_date <= record_date <= end_date:
+                selected_stats[cmd] += n
 
     return start_date, selected_stats, total_stats, earliest_date
-
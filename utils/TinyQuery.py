@@ -0,0 +1,13 @@
+INDEXED_FIELDS = ('uid', 'cid', 'chat_id', 'date')
+
+class Query:
+    def __init__(self):
+        self._query = {}
+
+    def __getattr__(self, item):
+        self._current_key = item
+        return self
+
+    def __eq__(self, other):
+        self._query[self._current_key] = other
+        return self
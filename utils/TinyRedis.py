@@ -1,87 +1,482 @@
+import inspect
 import redis
+import redis.asyncio
 import re
 import ssl
 import os
+import time
+from utils.TinyQuery import INDEXED_FIELDS, Query
 
-class Query:
-    def __init__(self):
-        self._query = {}
+SCAN_BATCH = 500
 
-    def __getattr__(self, item):
-        self._current_key = item
-        return self
+# ARGV: db_name, mode (update, upsert or incr), ttl, then counted lists of
+# query, field and default pairs and of the indexed field names.
+UPSERT_SCRIPT = """
+local db = ARGV[1]
+local mode = ARGV[2]
+local ttl = tonumber(ARGV[3])
+local pos = 4
+local function read_pairs()
+    local n = tonumber(ARGV[pos])
+    local list = {}
+    pos = pos + 1
+    for i = 1, n do
+        list[#list + 1] = {ARGV[pos], ARGV[pos + 1]}
+        pos = pos + 2
+    end
+    return list
+end
+local query = read_pairs()
+local fields = read_pairs()
+local defaults = read_pairs()
+local indexed = {}
+for i = 1, tonumber(ARGV[pos]) do
+    indexed[ARGV[pos + i]] = true
+end
 
-    def __eq__(self, other):
-        self._query[self._current_key] = other
-        return self
+local idx_keys = {}
+for _, kv in ipairs(query) do
+    if indexed[kv[1]] then
+        idx_keys[#idx_keys + 1] = db .. ':idx:' .. kv[1] .. ':' .. kv[2]
+    end
+end
 
-class TinyRedisDB:
-    _redis_connection = None  
+local updated = 0
+for _, id in ipairs(redis.call('SINTER', unpack(idx_keys))) do
+    local key = db .. ':record:' .. id
+    local match = redis.call('EXISTS', key) == 1
+    if not match then
+        for _, idx_key in ipairs(idx_keys) do
+            redis.call('SREM', idx_key, id)
+        end
+    end
+    for _, kv in ipairs(query) do
+        if match and redis.call('HGET', key, kv[1]) ~= kv[2] then
+            match = false
+        end
+    end
+    if match and mode == 'incr' then
+        for _, kv in ipairs(fields) do
+            redis.call('HINCRBY', key, kv[1], kv[2])
+        end
+    elseif match then
+        for _, kv in ipairs(fields) do
+            if indexed[kv[1]] then
+                local old = redis.call('HGET', key, kv[1])
+                if old then
+                    redis.call('SREM', db .. ':idx:' .. kv[1] .. ':' .. old, id)
+                end
+                redis.call('SADD', db .. ':idx:' .. kv[1] .. ':' .. kv[2], id)
+            end
+            redis.call('HSET', key, kv[1], kv[2])
+        end
+        for _, kv in ipairs(defaults) do
+            if redis.call('HSETNX', key, kv[1], kv[2]) == 1 and indexed[kv[1]] then
+                redis.call('SADD', db .. ':idx:' .. kv[1] .. ':' .. kv[2], id)
+            end
+        end
+    end
+    if match then
+        if ttl > 0 then
+            redis.call('EXPIRE', key, ttl)
+        end
+        updated = updated + 1
+    end
+end
+if updated > 0 or mode == 'update' then
+    return updated
+end
 
-    def __init__(self, db_name=None, url=None):
+local record = {}
+for _, list in ipairs({defaults, query, fields}) do
+    for _, kv in ipairs(list) do
+        record[kv[1]] = kv[2]
+    end
+end
+local id = redis.call('INCR', db .. ':next_id')
+local key = db .. ':record:' .. id
+redis.call('HSET', key, '_id', id)
+for field, value in pairs(record) do
+    redis.call('HSET', key, field, value)
+    if indexed[field] then
+        redis.call('SADD', db .. ':idx:' .. field .. ':' .. value, id)
+    end
+end
+if ttl > 0 then
+    redis.call('EXPIRE', key, ttl)
+end
+return 0
+"""
+
+class _TinyRedisBase:
+    # Operations are generators yielding steps (callables taking the
+    # client); the subclasses run them synchronously or awaiting each one.
+    def __init__(self, db_name=None, url=None, ttl=None):
         self.db_name = db_name or "default_db"
-        if TinyRedisDB._redis_connection is None:
-            url = url or os.getenv("REDIS_URL", "redis://localhost:6379")
-            TinyRedisDB._redis_connection = self._connect_via_url(url)
-        self.redis = TinyRedisDB._redis_connection
+        self.ttl = ttl
+        self.redis = self.connection(url)
+        self._index_ready = False
+        self._upsert_script = self.redis.register_script(UPSERT_SCRIPT)
 
     @staticmethod
-    def _connect_via_url(url):
+    def _connect_via_url(url, client=redis.StrictRedis):
         match = re.match(r'(?P<scheme>rediss?)://((?P<user>[^:]+):(?P<password>[^@]+)@)?(?P<host>[^:]+):(?P<port>\d+)', url)
         if not match:
             raise ValueError("Invalid Redis URL format")
         user, password, host, port, scheme = match.group('user'), match.group('password'), match.group('host'), int(match.group('port')), match.group('scheme')
         ssl_options = {'ssl': True, 'ssl_cert_reqs': ssl.CERT_NONE} if scheme == 'rediss' else {}
-        return redis.StrictRedis(host=host, port=port, username=user, password=password, decode_responses=True, **ssl_options) if user and password else redis.StrictRedis(host=host, port=port, decode_responses=True, **ssl_options)
+        return client(host=host, port=port, username=user, password=password, decode_responses=True, **ssl_options) if user and password else client(host=host, port=port, decode_responses=True, **ssl_options)
 
-    def insert(self, data):
-        record_id = self.redis.incr(f"{self.db_name}:next_id")
+    @classmethod
+    def _connection(cls, url, client):
+        if cls._redis_connection is None:
+            url = url or os.getenv("REDIS_URL", "redis://localhost:6379")
+            cls._redis_connection = cls._connect_via_url(url, client=client)
+        return cls._redis_connection
+
+    def _record_key(self, record_id):
+        return f"{self.db_name}:record:{record_id}"
+
+    def _index_key(self, field, value):
+        return f"{self.db_name}:idx:{field}:{value}"
+
+    def _index_add(self, pipe, record_id, data):
+        for field in INDEXED_FIELDS:
+            if field in data and data[field] is not None:
+                pipe.sadd(self._index_key(field, data[field]), record_id)
+
+    def _index_remove(self, pipe, record_id, data):
+        for field in INDEXED_FIELDS:
+            if field in data and data[field] is not None:
+                pipe.srem(self._index_key(field, data[field]), record_id)
+
+    def _matches(self, record, query):
+        for key, value in query.items():
+            record_value = record.get(key)
+            if isinstance(value, int):
+                if record_value is None or int(record_value) != value:
+                    return False
+            elif record_value != value:
+                return False
+        return True
+
+    def _expire(self, pipe, record_id):
+        if self.ttl:
+            pipe.expire(self._record_key(record_id), self.ttl)
+
+    def _prune_stale(self, pipe, ids, records, query):
+        # Expired records leave their ids in the idx:* sets.
+        stale = [record_id for record_id, record in zip(ids, records) if not record]
+        if not stale:
+            return False
+        for k, v in self._indexed_terms(query):
+            pipe.srem(self._index_key(k, v), *stale)
+        return True
+
+    @staticmethod
+    def _indexed_terms(query):
+        return [(k, v) for k, v in query.items() if k in INDEXED_FIELDS]
+
+    def _upsert_args(self, fields, query, mode, defaults=None):
+        if not self._indexed_terms(query):
+            return None
+        args = [self.db_name, mode, self.ttl or 0]
+        for pairs in (query.items(), fields.items(), (defaults or {}).items()):
+            pairs = [(k, v) for k, v in pairs if v is not None]
+            args.append(len(pairs))
+            for k, v in pairs:
+                args += [k, v]
+        return args + [len(INDEXED_FIELDS), *INDEXED_FIELDS]
+
+    # Operations.
+
+    def _page_op(self, cursor):
+        cursor, keys = yield lambda r: r.scan(cursor, match=f"{self.db_name}:record:*", count=SCAN_BATCH)
+        if not keys:
+            return cursor, []
+        pipe = yield lambda r: r.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        records = yield lambda r: pipe.execute(raise_on_error=False)
+        return cursor, [record for record in records if isinstance(record, dict) and record]
+
+    def _all_op(self):
+        records, cursor = [], 0
+        while True:
+            cursor, page = yield from self._page_op(cursor)
+            records += page
+            if cursor == 0:
+                return records
+
+    def _delete_matching_op(self, match):
+        cursor = 0
+        while True:
+            cursor, keys = yield lambda r: r.scan(cursor, match=match, count=SCAN_BATCH)
+            if keys:
+                yield lambda r: r.delete(*keys)
+            if cursor == 0:
+                return
+
+    def _reindex_op(self):
+        yield from self._delete_matching_op(f"{self.db_name}:idx:*")
+        cursor = 0
+        while True:
+            cursor, records = yield from self._page_op(cursor)
+            if records:
+                pipe = yield lambda r: r.pipeline(transaction=False)
+                for record in records:
+                    self._index_add(pipe, record['_id'], record)
+                yield lambda r: pipe.execute()
+            if cursor == 0:
+                break
+        yield lambda r: r.set(f"{self.db_name}:idx:ready", 1)
+        self._index_ready = True
+
+    def _ensure_index_op(self):
+        # Records written before indexing existed have no idx:* entries;
+        # build them once per keyspace and remember it in a marker key.
+        if self._index_ready:
+            return
+        if not (yield lambda r: r.exists(f"{self.db_name}:idx:ready")):
+            yield from self._reindex_op()
+        self._index_ready = True
+
+    def _candidate_ids_op(self, query):
+        indexed = self._indexed_terms(query)
+        if not indexed:
+            return None
+        yield from self._ensure_index_op()
+        return (yield lambda r: r.sinter([self._index_key(k, v) for k, v in indexed]))
+
+    def _insert_op(self, data):
+        record_id = yield lambda r: r.incr(f"{self.db_name}:next_id")
         data['_id'] = record_id
-        self.redis.hset(f"{self.db_name}:record:{record_id}", mapping=data)
+        pipe = yield lambda r: r.pipeline()
+        pipe.hset(self._record_key(record_id), mapping=data)
+        self._index_add(pipe, record_id, data)
+        self._expire(pipe, record_id)
+        yield lambda r: pipe.execute()
         return record_id
 
+    def _update_op(self, fields, query, defaults=None):
+        records = yield from self._search_op(query)
+        if not records:
+            return 0
+        pipe = yield lambda r: r.pipeline()
+        for record in records:
+            values = {**{k: v for k, v in (defaults or {}).items() if k not in record}, **fields}
+            changed = {k: record[k] for k in INDEXED_FIELDS if k in values and k in record}
+            self._index_remove(pipe, record['_id'], changed)
+            pipe.hset(self._record_key(record['_id']), mapping=values)
+            self._index_add(pipe, record['_id'], values)
+            self._expire(pipe, record['_id'])
+        yield lambda r: pipe.execute()
+        return len(records)
+
+    def _script_op(self, fields, query, mode, defaults=None):
+        args = self._upsert_args(fields, query, mode, defaults)
+        if args is None:
+            raise ValueError(f"{mode} needs an indexed field in the query")
+        yield from self._ensure_index_op()
+        return (yield lambda r: self._upsert_script(args=args))
+
+    def _upsert_op(self, fields, query, defaults=None):
+        if not self._indexed_terms(query._query):
+            if not (yield from self._update_op(fields, query, defaults)):
+                yield from self._insert_op({**(defaults or {}), **query._query, **fields})
+            return
+        yield from self._script_op(fields, query._query, "upsert", defaults)
+
+    def _remove_op(self, query):
+        records = yield from self._search_op(query)
+        if not records:
+            return 0
+        pipe = yield lambda r: r.pipeline()
+        for record in records:
+            pipe.delete(self._record_key(record['_id']))
+            self._index_remove(pipe, record['_id'], record)
+        yield lambda r: pipe.execute()
+        return len(records)
+
+    def _search_op(self, query):
+        ids = yield from self._candidate_ids_op(query._query)
+        if ids is None:
+            records = yield from self._all_op()
+            return [record for record in records if self._matches(record, query._query)]
+        ids = list(ids)
+        pipe = yield lambda r: r.pipeline(transaction=False)
+        for record_id in ids:
+            pipe.hgetall(self._record_key(record_id))
+        records = yield lambda r: pipe.execute()
+        if self._prune_stale(pipe, ids, records, query._query):
+            yield lambda r: pipe.execute()
+        return [record for record in records if record and self._matches(record, query._query)]
+
+    def _truncate_op(self):
+        yield from self._delete_matching_op(f"{self.db_name}:record:*")
+        yield from self._delete_matching_op(f"{self.db_name}:idx:*")
+        yield lambda r: r.set(f"{self.db_name}:next_id", 0)
+        yield lambda r: r.set(f"{self.db_name}:idx:ready", 1)
+        self._index_ready = True
+
+    def _remove_expired_op(self, field, ttl):
+        # For records written before the table had a TTL.
+        removed, cursor = 0, 0
+        deadline = time.time() - ttl
+        while True:
+            cursor, records = yield from self._page_op(cursor)
+            expired = [record for record in records if float(record.get(field) or 0) < deadline]
+            if expired:
+                pipe = yield lambda r: r.pipeline()
+                for record in expired:
+                    pipe.delete(self._record_key(record['_id']))
+                    self._index_remove(pipe, record['_id'], record)
+                yield lambda r: pipe.execute()
+                removed += len(expired)
+            if cursor == 0:
+                return removed
+
+class TinyRedisDB(_TinyRedisBase):
+    _redis_connection = None
+
+    @classmethod
+    def connection(cls, url=None):
+        return cls._connection(url, redis.StrictRedis)
+
+    def _run(self, op):
+        try:
+            step = next(op)
+            while True:
+                step = op.send(step(self.redis))
+        except StopIteration as stop:
+            return stop.value
+
+    def reindex(self):
+        self._run(self._reindex_op())
+
+    def _delete_matching(self, match):
+        self._run(self._delete_matching_op(match))
+
+    def insert(self, data):
+        return self._run(self._insert_op(data))
+
     def update(self, fields, query):
-        updated = 0
-        for record in self.search(query):
-            self.redis.hset(f"{self.db_name}:record:{record['_id']}", mapping=fields)
-            updated += 1
-        return updated
+        return self._run(self._update_op(fields, query))
+
+    def upsert(self, fields, query):
+        self._run(self._upsert_op(fields, query))
+
+    def upsert_with_defaults(self, fields, defaults, query):
+        # As upsert(), but the defaults are only written where absent.
+        self._run(self._upsert_op(fields, query, defaults))
+
+    def increment(self, counters, query):
+        self._run(self._script_op(counters, query._query, "incr"))
+
+    def update_if(self, fields, query, expected):
+        # Compare-and-set; returns how many records changed.
+        return self._run(self._script_op(fields, {**query._query, **expected}, "update"))
 
     def remove(self, query):
-        deleted = 0
-        for record in self.search(query):
-            self.redis.delete(f"{self.db_name}:record:{record['_id']}")
-            deleted += 1
-        return deleted
+        return self._run(self._remove_op(query))
 
     def search(self, query):
-        return [record for record in self.all() if self._matches(record, query._query)]
+        return self._run(self._search_op(query))
 
     def get(self, query):
         records = self.search(query)
         return records[0] if records else None
 
     def all(self):
-        return [self.redis.hgetall(key) for key in self.redis.keys(f"{self.db_name}:record:*") if self.redis.type(key) == 'hash']
+        return list(self)
 
-    def _matches(self, record, query):
-        for key, value in query.items():
-            record_value = record.get(key)
-            if isinstance(value, int):
-                if record_value is None or int(record_value) != value:
-                    return False
-            elif record_value != value:
-                return False
-        return True
+    def __iter__(self):
+        cursor = 0
+        while True:
+            cursor, records = self._run(self._page_op(cursor))
+            yield from records
+            if cursor == 0:
+                return
 
     def truncate(self):
-        keys = self.redis.keys(f"{self.db_name}:record:*")
-        if keys:
-            self.redis.delete(*keys)
-        self.redis.set(f"{self.db_name}:next_id", 0)
+        self._run(self._truncate_op())
 
     def contains(self, query):
-        for record in self.all():
-            if self._matches(record, query._query):
-                return True
-        return False
\ No newline at end of file
+        return self.get(query) is not None
+
+    def remove_expired(self, field, ttl):
+        return self._run(self._remove_expired_op(field, ttl))
+
+class AsyncTinyRedisDB(_TinyRedisBase):
+    _redis_connection = None
+
+    @classmethod
+    def connection(cls, url=None):
+        return cls._connection(url, redis.asyncio.StrictRedis)
+
+    async def _run(self, op):
+        # pipeline() is not awaitable on the asyncio client.
+        try:
+            step = next(op)
+            while True:
+                result = step(self.redis)
+                if inspect.isawaitable(result):
+                    result = await result
+                step = op.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    async def reindex(self):
+        await self._run(self._reindex_op())
+
+    async def _delete_matching(self, match):
+        await self._run(self._delete_matching_op(match))
+
+    async def insert(self, data):
+        return await self._run(self._insert_op(data))
+
+    async def update(self, fields, query):
+        return await self._run(self._update_op(fields, query))
+
+    async def upsert(self, fields, query):
+        await self._run(self._upsert_op(fields, query))
+
+    async def upsert_with_defaults(self, fields, defaults, query):
+        await self._run(self._upsert_op(fields, query, defaults))
+
+    async def increment(self, counters, query):
+        await self._run(self._script_op(counters, query._query, "incr"))
+
+    async def update_if(self, fields, query, expected):
+        return await self._run(self._script_op(fields, {**query._query, **expected}, "update"))
+
+    async def remove(self, query):
+        return await self._run(self._remove_op(query))
+
+    async def search(self, query):
+        return await self._run(self._search_op(query))
+
+    async def get(self, query):
+        records = await self.search(query)
+        return records[0] if records else None
+
+    async def all(self):
+        return [record async for record in self]
+
+    async def __aiter__(self):
+        cursor = 0
+        while True:
+            cursor, records = await self._run(self._page_op(cursor))
+            for record in records:
+                yield record
+            if cursor == 0:
+                return
+
+    async def truncate(self):
+        await self._run(self._truncate_op())
+
+    async def contains(self, query):
+        return await self.get(query) is not None
+
+    async def remove_expired(self, field, ttl):
+        return await self._run(self._remove_expired_op(field, ttl))
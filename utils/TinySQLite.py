@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from utils.TinyQuery import INDEXED_FIELDS
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "db/bot.sqlite3")
+PAGE_SIZE = 500
+
+def _table_name(db_name: str) -> str:
+    # Built from the whole path relative to the working directory, so
+    # db/a/stats.json and db/b/stats.json get separate tables; the hash
+    # keeps paths that sanitize to the same name apart.
+    path = os.path.relpath(os.path.abspath(db_name))
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:8]
+    return "t_" + re.sub(r"\W", "_", path) + "_" + digest
+
+def _legacy_table_name(db_name: str) -> str:
+    # Tables used to be named after the file name alone.
+    return "t_" + re.sub(r"\W", "_", Path(db_name).stem)
+
+def drop_table(db_name: str, path=None):
+    conn, lock = TinySQLiteDB._connect(path or SQLITE_PATH)
+    with lock:
+        conn.execute(f"DROP TABLE IF EXISTS {_table_name(db_name)}")
+        conn.execute(f"DROP TABLE IF EXISTS {_legacy_table_name(db_name)}")
+
+class Document(dict):
+    # A record with its row id, like TinyDB's Document.
+    def __init__(self, value, doc_id):
+        super().__init__(value)
+        self.doc_id = doc_id
+
+class TinySQLiteDB:
+    # One connection per database file is shared by every table and thread;
+    # sqlite3 objects are not safe for concurrent use, so all access goes
+    # through the connection's lock.
+    _connections = {}
+    _connections_lock = threading.Lock()
+
+    def __init__(self, db_name=None, path=None):
+        self.db_name = db_name or "default_db"
+        self.table = _table_name(self.db_name)
+        self.conn, self._lock = self._connect(path or SQLITE_PATH)
+        self._create_table()
+
+    @classmethod
+    def _connect(cls, path):
+        with cls._connections_lock:
+            if path not in cls._connections:
+                conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=256)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                cls._connections[path] = (conn, threading.RLock())
+            return cls._connections[path]
+
+    def _create_table(self):
+        with self._lock:
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.table,)
+            ).fetchone()
+            if exists:
+                return
+            # A table created under the old file-name-only name is taken
+            # over by the first path that opens it.
+            legacy = _legacy_table_name(self.db_name)
+            if self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (legacy,)
+            ).fetchone():
+                self.conn.execute(f"ALTER TABLE {legacy} RENAME TO {self.table}")
+                return
+            # Indexed columns are declared without a type so values keep the
+            # type they were written with, as in the JSON backend: uid 1 and
+            # uid "1" are different keys.
+            self.conn.execute(
+                f"CREATE TABLE {self.table} (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                f"{', '.join(INDEXED_FIELDS)}, data TEXT NOT NULL)"
+            )
+            for field in INDEXED_FIELDS:
+                self.conn.execute(f"CREATE INDEX {self.table}_{field} ON {self.table} ({field})")
+            self._import_json()
+
+    def _import_json(self):
+        if not self.db_name.endswith(".json") or not os.path.exists(self.db_name):
+            return
+        try:
+            with open(self.db_name, encoding="utf-8") as f:
+                documents = list(json.load(f).get("_default", {}).values())
+        except (OSError, ValueError, AttributeError):
+            return
+        if documents:
+            self._insert_many(documents)
+
+    @staticmethod
+    def _column_value(value):
+        if value is None or isinstance(value, (int, float, str)):
+            return value
+        return json.dumps(value, ensure_ascii=False)
+
+    def _row(self, data):
+        return [self._column_value(data.get(field)) for field in INDEXED_FIELDS] + [json.dumps(data, ensure_ascii=False)]
+
+    def _where(self, query):
+        if not query:
+            return "1", []
+        clauses, params = [], []
+        for key, value in query.items():
+            if key in INDEXED_FIELDS:
+                clauses.append(f"{key} IS ?")
+            else:
+                clauses.append("json_extract(data, ?) IS ?")
+                params.append(f'$."{key}"')
+            params.append(self._column_value(value))
+        return " AND ".join(clauses), params
+
+    def _insert_many(self, documents):
+        placeholders = ", ".join("?" * (len(INDEXED_FIELDS) + 1))
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    f"INSERT INTO {self.table} ({', '.join(INDEXED_FIELDS)}, data) VALUES ({placeholders})",
+                    [self._row(document) for document in documents],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _update_locked(self, fields, query, defaults=None):
+        where, params = self._where(query._query)
+        rows = self.conn.execute(f"SELECT id, data FROM {self.table} WHERE {where}", params).fetchall()
+        updates = []
+        for record_id, data in rows:
+            document = {**(defaults or {}), **json.loads(data)}
+            document.update(fields)
+            updates.append(self._row(document) + [record_id])
+        if updates:
+            assignments = ", ".join(f"{field} = ?" for field in INDEXED_FIELDS)
+            self.conn.executemany(f"UPDATE {self.table} SET {assignments}, data = ? WHERE id = ?", updates)
+        return len(updates)
+
+    def insert(self, data):
+        placeholders = ", ".join("?" * (len(INDEXED_FIELDS) + 1))
+        with self._lock:
+            cursor = self.conn.execute(
+                f"INSERT INTO {self.table} ({', '.join(INDEXED_FIELDS)}, data) VALUES ({placeholders})",
+                self._row(data),
+            )
+            return cursor.lastrowid
+
+    def update(self, fields, query):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = self._update_locked(fields, query)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            return updated
+
+    def upsert(self, fields, query):
+        self.upsert_with_defaults(fields, {}, query)
+
+    def upsert_with_defaults(self, fields, defaults, query):
+        # As upsert(), but the defaults are only written where absent.
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not self._update_locked(fields, query, defaults):
+                    self.insert({**defaults, **query._query, **fields})
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def increment(self, counters, query):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                where, params = self._where(query._query)
+                rows = self.conn.execute(f"SELECT id, data FROM {self.table} WHERE {where}", params).fetchall()
+                if not rows:
+                    self.insert({**query._query, **counters})
+                for record_id, data in rows:
+                    document = json.loads(data)
+                    for field, amount in counters.items():
+                        document[field] = int(document.get(field) or 0) + amount
+                    self.conn.execute(
+                        f"UPDATE {self.table} SET data = ? WHERE id = ?",
+                        (json.dumps(document, ensure_ascii=False), record_id),
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def remove(self, query):
+        where, params = self._where(query._query)
+        with self._lock:
+            return self.conn.execute(f"DELETE FROM {self.table} WHERE {where}", params).rowcount
+
+    def search(self, query):
+        where, params = self._where(query._query)
+        with self._lock:
+            rows = self.conn.execute(f"SELECT id, data FROM {self.table} WHERE {where} ORDER BY id", params).fetchall()
+        return [Document(json.loads(data), record_id) for record_id, data in rows]
+
+    def get(self, query):
+        where, params = self._where(query._query)
+        with self._lock:
+            row = self.conn.execute(f"SELECT id, data FROM {self.table} WHERE {where} ORDER BY id LIMIT 1", params).fetchone()
+        return Document(json.loads(row[1]), row[0]) if row else None
+
+    def contains(self, query):
+        where, params = self._where(query._query)
+        with self._lock:
+            return self.conn.execute(f"SELECT 1 FROM {self.table} WHERE {where} LIMIT 1", params).fetchone() is not None
+
+    def all(self):
+        return list(self)
+
+    def __iter__(self):
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT id, data FROM {self.table} WHERE id > ? ORDER BY id LIMIT ?", (last_id, PAGE_SIZE)
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            for record_id, data in rows:
+                yield Document(json.loads(data), record_id)
+
+    def truncate(self):
+        with self._lock:
+            self.conn.execute(f"DELETE FROM {self.table}")
+            self.conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (self.table,))
+
+    def remove_expired(self, field, ttl, batch=PAGE_SIZE):
+        deadline = time.time() - ttl
+        removed = 0
+        while True:
+            with self._lock:
+                count = self.conn.execute(
+                    f"DELETE FROM {self.table} WHERE id IN (SELECT id FROM {self.table} "
+                    f"WHERE CAST(json_extract(data, ?) AS REAL) < ? LIMIT ?)",
+                    (f'$."{field}"', deadline, batch),
+                ).rowcount
+            removed += count
+            if count < batch:
+                return removed
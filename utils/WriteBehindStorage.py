@@ -0,0 +1,119 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from tinydb.storages import Storage
+
+FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", 5))
+FLUSH_THRESHOLD = int(os.getenv("DB_FLUSH_THRESHOLD", 100))
+
+_storages = []
+_storages_lock = threading.Lock()
+_flusher = None
+
+
+class WriteBehindStorage(Storage):
+    # Keeps the whole database in memory and writes it to disk only every
+    # FLUSH_INTERVAL seconds or after FLUSH_THRESHOLD writes, whichever
+    # comes first. read() hands TinyDB a copy, so the snapshot owned by the
+    # storage is never mutated outside the lock and can be flushed from the
+    # background thread.
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL, flush_threshold: int = FLUSH_THRESHOLD):
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = 0
+        self._last_flush = time.monotonic()
+        self._data = self._load()
+        _register(self)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        return json.loads(content) if content.strip() else None
+
+    def read(self):
+        with self._lock:
+            if self._data is None:
+                return None
+            return {name: {doc_id: dict(doc) for doc_id, doc in table.items()} for name, table in self._data.items()}
+
+    def write(self, data):
+        with self._lock:
+            self._data = data
+            self._dirty += 1
+            due = self._dirty >= self.flush_threshold
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                payload = json.dumps(self._data)
+                self._dirty = 0
+                self._last_flush = time.monotonic()
+
+            directory = os.path.dirname(self.path) or "."
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except Exception:
+                with self._lock:
+                    self._dirty += 1
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def flush_if_due(self):
+        with self._lock:
+            due = self._dirty and time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def close(self):
+        self.flush()
+
+
+def _register(storage):
+    global _flusher
+    with _storages_lock:
+        _storages.append(storage)
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="db-flusher", daemon=True)
+            _flusher.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(1)
+        with _storages_lock:
+            storages = list(_storages)
+        for storage in storages:
+            try:
+                storage.flush_if_due()
+            except Exception as e:
+                print(f"Ошибка сохранения {storage.path}: {e}")
+
+
+def flush_all():
+    with _storages_lock:
+        storages = list(_storages)
+    for storage in storages:
+        storage.flush()
+
+
+atexit.register(flush_all)
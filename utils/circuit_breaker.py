@@ -0,0 +1,126 @@
+import time
+from collections import deque
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class BulkheadFullError(CircuitOpenError):
+    pass
+
+
+class _Call:
+    def __init__(self, breaker, probe: bool):
+        self.breaker = breaker
+        self.probe = probe
+        self.ok = True
+
+    def fail(self):
+        # Counts the call as failed without raising, for bad statuses that
+        # the caller handles itself.
+        self.ok = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.breaker._finish(self.ok and exc_type is None, self.probe)
+        return False
+
+
+class CircuitBreaker:
+    # Tracks the outcome of calls to one upstream over the last `window`
+    # seconds. Once at least min_calls were made and failure_rate of them
+    # failed, the breaker opens and call() raises CircuitOpenError at once
+    # for open_for seconds; then a single probe call is let through
+    # (half-open) and its outcome closes or reopens the breaker. At most
+    # max_in_flight calls run at a time (BulkheadFullError beyond that).
+    def __init__(self, name: str, window: float = 60, min_calls: int = 5, failure_rate: float = 0.5,
+                 open_for: float = 30, max_in_flight: int = 20):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_for = open_for
+        self.max_in_flight = max_in_flight
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.in_flight = 0
+        self._results = deque()
+        self._probing = False
+
+    def _trim(self, now):
+        while self._results and now - self._results[0][0] > self.window:
+            self._results.popleft()
+
+    def call(self) -> _Call:
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now - self.opened_at < self.open_for:
+                raise CircuitOpenError(f"{self.name}: circuit open")
+            self.state = HALF_OPEN
+        probe = self.state == HALF_OPEN
+        if probe:
+            if self._probing:
+                raise CircuitOpenError(f"{self.name}: circuit half-open")
+            self._probing = True
+        elif self.in_flight >= self.max_in_flight:
+            raise BulkheadFullError(f"{self.name}: too many requests in flight")
+        self.in_flight += 1
+        return _Call(self, probe)
+
+    def _finish(self, ok: bool, probe: bool):
+        now = time.monotonic()
+        self.in_flight -= 1
+        if probe:
+            self._probing = False
+            self._results.clear()
+            if ok:
+                self.state = CLOSED
+            else:
+                self.state = OPEN
+                self.opened_at = now
+            return
+        if self.state != CLOSED:
+            # Started before the breaker opened; the probe decides.
+            return
+        self._results.append((now, ok))
+        self._trim(now)
+        failures = sum(1 for _, result in self._results if not result)
+        if len(self._results) >= self.min_calls and failures >= self.failure_rate * len(self._results):
+            self.state = OPEN
+            self.opened_at = now
+
+    def is_open(self) -> bool:
+        return self.state == OPEN and time.monotonic() - self.opened_at < self.open_for
+
+    def stats(self):
+        self._trim(time.monotonic())
+        failures = sum(1 for _, result in self._results if not result)
+        return len(self._results), failures
+
+
+_breakers = {}
+
+
+def get_breaker(name: str, **options) -> CircuitBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name, **options)
+    return breaker
+
+
+def format_breakers() -> str:
+    if not _breakers:
+        return " └─ нет данных"
+    lines = []
+    items = sorted(_breakers.items())
+    for i, (name, breaker) in enumerate(items):
+        calls, failures = breaker.stats()
+        state = OPEN if breaker.is_open() else breaker.state
+        prefix = "└─" if i == len(items) - 1 else "├─"
+        lines.append(f" {prefix} {name}: {state}, {failures}/{calls} errors, {breaker.in_flight}/{breaker.max_in_flight} in flight")
+    return "\n".join(lines)
@@ -1,4 +1,5 @@
 import json
+import time
 from functools import wraps
 from aiogram.types import Message
 from utils.dbmanager import DB
@@ -6,31 +7,86 @@ from localization import DEFAULT_LANGUAGE, get_localization
 
 command_db, CommandQuery = DB('db/command_states.json').get_db()
 
-def load_disabled_commands():
+# The parsed map is cached with the version it was read at. With Redis,
+# saves bump VERSION_KEY and it is polled at most every
+# VERSION_CHECK_INTERVAL seconds; other backends have no version and the
+# row is read again at that interval instead, so a change made by
+# another process over a shared file is picked up too.
+VERSION_KEY = "command_states:version"
+VERSION_CHECK_INTERVAL = 5
+
+_cache = None
+_checked_at = 0.0
+_version_store = False
+
+def _empty():
+    return {"global": {}, "chat": {}}
+
+def _version_redis():
+    global _version_store
+    if _version_store is False:
+        from utils.dbmanager import _backend
+        _version_store = None
+        if _backend(local=False) == "redis":
+            from utils.TinyRedis import TinyRedisDB
+            _version_store = TinyRedisDB.connection()
+    return _version_store
+
+def _stored_version():
+    redis = _version_redis()
+    if redis is None:
+        return None
+    try:
+        return int(redis.get(VERSION_KEY) or 0)
+    except Exception as e:
+        print(f"Ошибка чтения {VERSION_KEY}: {e}")
+        return _cache[0] if _cache else None
+
+def _read_disabled_commands():
     context_item = command_db.get(CommandQuery().uid == "disabled_commands")
     if context_item:
         try:
             return json.loads(context_item.get('data', '{}'))
         except json.JSONDecodeError:
-            return {"global": {}, "chat": {}}
-    return {"global": {}, "chat": {}}
+            return _empty()
+    return _empty()
+
+def _disabled_commands():
+    # Shared, read-only view; copy before changing it.
+    global _cache, _checked_at
+    now = time.monotonic()
+    if _cache is None or now - _checked_at >= VERSION_CHECK_INTERVAL:
+        _checked_at = now
+        # The version is read before the data, so a save that lands in
+        # between is picked up again on the next check.
+        version = _stored_version()
+        if _cache is None or version is None or version != _cache[0]:
+            _cache = (version, _read_disabled_commands())
+    return _cache[1]
+
+def load_disabled_commands():
+    disabled_commands = _disabled_commands()
+    return {
+        "global": dict(disabled_commands.get("global", {})),
+        "chat": {chat_id: dict(commands) for chat_id, commands in disabled_commands.get("chat", {}).items()},
+    }
 
 def save_disabled_commands(disabled_commands):
+    global _cache
     new_data = {
         'uid': "disabled_commands",
         'data': json.dumps(disabled_commands, ensure_ascii=False)
     }
-    context_item = command_db.get(CommandQuery().uid == "disabled_commands")
-    if context_item:
-        command_db.update(new_data, CommandQuery().uid == "disabled_commands")
-    else:
-        command_db.insert(new_data)
+    command_db.upsert(new_data, CommandQuery().uid == "disabled_commands")
+    redis = _version_redis()
+    version = redis.incr(VERSION_KEY) if redis is not None else None
+    _cache = (version, disabled_commands)
 
 def get_disabled_commands():
     return load_disabled_commands()
 
 def is_command_enabled(command: str, chat_id: int) -> bool:
-    disabled_commands = load_disabled_commands()
+    disabled_commands = _disabled_commands()
     if command in disabled_commands["global"]:
         return False
     return command not in disabled_commands["chat"].get(str(chat_id), {})
@@ -60,7 +116,7 @@ def check_command_enabled(command_name):
     def decorator(handler):
         @wraps(handler)
         async def wrapper(message: Message, *args, **kwargs):
-            disabled_commands = load_disabled_commands()
+            disabled_commands = _disabled_commands()
             chat_id = str(message.chat.id)
             lang = None
             if 'lang' in kwargs:
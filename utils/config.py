@@ -0,0 +1,110 @@
+import asyncio
+import os
+from types import MappingProxyType
+from dotenv import dotenv_values, find_dotenv
+
+CONFIG_PATH = os.getenv("CONFIG_PATH") or find_dotenv(usecwd=True) or ".env"
+CONFIG_POLL_INTERVAL = float(os.getenv("CONFIG_POLL_INTERVAL", 5))
+# The environment the process was started with, before any .env file was
+# applied; utils.dbmanager imports this module instead of calling
+# load_dotenv() so that nothing is loaded before this copy is taken.
+_PROCESS_ENV = dict(os.environ)
+
+
+class ConfigStore:
+    # The process environment overlaid with the .env file, published as an
+    # immutable snapshot: readers take `config.snapshot` without locking
+    # and keep a consistent view, a reload swaps in a new one. The file is
+    # parsed again only when its mtime changes (or on a forced reload);
+    # changed values are also written to os.environ, as
+    # load_dotenv(override=True) did, for code that still reads it, and
+    # variables removed from the file are removed from it again.
+    # Listeners registered with on_reload() run after every change.
+    def __init__(self, path: str = CONFIG_PATH):
+        self.path = path
+        self.version = 0
+        self.snapshot = MappingProxyType(dict(os.environ))
+        self._base = dict(_PROCESS_ENV)
+        self._mtime = None
+        self._listeners = []
+        self.reload()
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self, force: bool = False) -> list:
+        # Returns the names of the variables that changed.
+        mtime = self._stat()
+        if mtime == self._mtime and not force:
+            return []
+        self._mtime = mtime
+        values = dotenv_values(self.path) if mtime is not None else {}
+        current = {**self._base, **{k: v for k, v in values.items() if v is not None}}
+        changed = sorted(k for k in current.keys() | self.snapshot.keys()
+                         if current.get(k) != self.snapshot.get(k))
+        if not changed:
+            return []
+        for key in changed:
+            if key in current:
+                os.environ[key] = current[key]
+            else:
+                os.environ.pop(key, None)
+        self.snapshot = MappingProxyType(current)
+        self.version += 1
+        for listener in list(self._listeners):
+            self._notify(listener)
+        return changed
+
+    def _notify(self, listener):
+        try:
+            listener(self.snapshot)
+        except Exception as e:
+            print(f"Ошибка применения конфигурации: {e}")
+
+    def on_reload(self, listener):
+        # Also called right away with the current snapshot.
+        self._listeners.append(listener)
+        self._notify(listener)
+        return listener
+
+    def get(self, key: str, default=None):
+        return self.snapshot.get(key, default)
+
+
+config = ConfigStore()
+
+
+async def _watch_loop():
+    while True:
+        await asyncio.sleep(CONFIG_POLL_INTERVAL)
+        try:
+            changed = config.reload()
+        except Exception as e:
+            print(f"Ошибка чтения {config.path}: {e}")
+            continue
+        if changed:
+            print(f"Конфигурация обновлена: {', '.join(changed)}")
+
+
+_watcher_task = None
+
+
+def start_config_watcher():
+    global _watcher_task
+    if _watcher_task is None or _watcher_task.done():
+        _watcher_task = asyncio.create_task(_watch_loop())
+    return _watcher_task
+
+
+async def stop_config_watcher():
+    global _watcher_task
+    if _watcher_task is not None:
+        _watcher_task.cancel()
+        try:
+            await _watcher_task
+        except asyncio.CancelledError:
+            pass
+        _watcher_task = None
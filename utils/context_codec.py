@@ -0,0 +1,43 @@
+import base64
+import json
+import brotli
+
+# Stored values stay text, since both Redis (decode_responses=True) and the
+# JSON files only hold strings. Every encoded value starts with a codec tag.
+COMPRESS_MIN_BYTES = 512
+BROTLI_QUALITY = 5
+
+
+class JsonCodec:
+    tag = "j:"
+
+    def encode(self, raw: bytes) -> str:
+        return raw.decode("utf-8")
+
+    def decode(self, payload: str) -> bytes:
+        return payload.encode("utf-8")
+
+
+class BrotliCodec:
+    tag = "b:"
+
+    def encode(self, raw: bytes) -> str:
+        return base64.b85encode(brotli.compress(raw, mode=brotli.MODE_TEXT, quality=BROTLI_QUALITY)).decode("ascii")
+
+    def decode(self, payload: str) -> bytes:
+        return brotli.decompress(base64.b85decode(payload))
+
+
+CODECS = {codec.tag: codec for codec in (JsonCodec(), BrotliCodec())}
+
+
+def encode_messages(messages, min_compress: int = COMPRESS_MIN_BYTES) -> str:
+    raw = json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    codec = CODECS[BrotliCodec.tag] if len(raw) >= min_compress else CODECS[JsonCodec.tag]
+    return codec.tag + codec.encode(raw)
+
+
+def decode_messages(value, default=None):
+    if not value:
+        return default
+    return json.loads(CODECS[value[:2]].decode(value[2:]))
@@ -0,0 +1,169 @@
+import json
+import time
+
+AUTH_COOLDOWN = 600
+QUOTA_COOLDOWN = 60
+ERROR_COOLDOWN = 15
+MAX_COOLDOWN = 3600
+# Plain errors only quarantine a credential after this many in a row; a
+# single timeout says more about the upstream than about the key.
+ERROR_STREAK = 3
+LATENCY_ALPHA = 0.2
+
+
+class Credential:
+    def __init__(self, index: int, value, label: str):
+        self.index = index
+        self.value = value
+        self.label = label
+        self.successes = 0
+        self.failures = 0
+        self.streak = 0
+        self.latency = None
+        self.cooldown_until = 0.0
+        self.last_used = 0.0
+        self.last_error = None
+
+    @property
+    def score(self) -> float:
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+
+def _identity(value) -> str:
+    return value if isinstance(value, str) else json.dumps(value, sort_keys=True, default=str)
+
+
+def mask(value: str) -> str:
+    value = str(value)
+    return value if len(value) <= 8 else f"{value[:4]}…{value[-4:]}"
+
+
+class CredentialPool:
+    # API keys or cookies of one upstream with their health: success rate,
+    # average latency and a cooldown after auth, quota or repeated errors.
+    # acquire() returns the healthiest credential that is not cooling
+    # down, least recently used first among equally healthy ones; a sticky
+    # pool keeps returning the last credential that worked while it stays
+    # available. When every credential is cooling down, the one that
+    # recovers first is returned rather than nothing.
+    def __init__(self, name: str, values=(), label=None, sticky: bool = False):
+        self.name = name
+        self.label = label or mask
+        self.sticky = sticky
+        self.credentials = []
+        self._preferred = None
+        self.set_credentials(values)
+
+    def set_credentials(self, values):
+        # Keeps the stats of credentials that are still configured.
+        known = {_identity(c.value): c for c in self.credentials}
+        credentials = []
+        for index, value in enumerate(values):
+            credential = known.get(_identity(value)) or Credential(index, value, self.label(value))
+            credential.index = index
+            credential.value = value
+            credentials.append(credential)
+        self.credentials = credentials
+        if self._preferred not in credentials:
+            self._preferred = None
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def acquire(self, exclude=()) -> Credential | None:
+        # exclude holds Credential objects, which outlive a reload as long
+        # as their value is still configured; indexes may shift.
+        now = time.monotonic()
+        candidates = [c for c in self.credentials if c not in exclude]
+        if not candidates:
+            return None
+        available = [c for c in candidates if c.available(now)]
+        if not available:
+            credential = min(candidates, key=lambda c: c.cooldown_until)
+        elif self.sticky and self._preferred in available:
+            credential = self._preferred
+        else:
+            credential = max(available, key=lambda c: (round(c.score, 1), -c.last_used))
+        credential.last_used = now
+        return credential
+
+    def success(self, credential: Credential, latency: float = None):
+        credential.successes += 1
+        credential.streak = 0
+        credential.cooldown_until = 0.0
+        if latency is not None:
+            credential.latency = latency if credential.latency is None else (
+                LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * credential.latency
+            )
+        if self.sticky:
+            self._preferred = credential
+
+    def failure(self, credential: Credential, kind: str = "error", retry_after: float = None, detail: str = None):
+        # kind: "auth" (401/403), "quota" (429 or a quota message) or
+        # "error" (5xx, timeouts, bad responses).
+        credential.failures += 1
+        credential.streak += 1
+        credential.last_error = detail or kind
+        if kind == "auth":
+            cooldown = AUTH_COOLDOWN
+        elif kind == "quota":
+            cooldown = retry_after or QUOTA_COOLDOWN * 2 ** min(credential.streak - 1, 6)
+        elif credential.streak >= ERROR_STREAK:
+            cooldown = ERROR_COOLDOWN * 2 ** min(credential.streak - ERROR_STREAK, 6)
+        else:
+            return
+        credential.cooldown_until = time.monotonic() + min(cooldown, MAX_COOLDOWN)
+        if self._preferred is credential:
+            self._preferred = None
+
+    def report(self, credential: Credential, status: int, latency: float = None, retry_after: float = None):
+        # Records the outcome of one HTTP response made with the credential.
+        if status < 400:
+            self.success(credential, latency)
+        elif status in (401, 403):
+            self.failure(credential, "auth", detail=str(status))
+        elif status == 429:
+            self.failure(credential, "quota", retry_after, detail=str(status))
+        elif status >= 500:
+            self.failure(credential, "error", detail=str(status))
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        return [
+            {
+                'label': c.label,
+                'successes': c.successes,
+                'failures': c.failures,
+                'score': c.score,
+                'latency': c.latency,
+                'cooldown': max(0.0, c.cooldown_until - now),
+                'last_error': c.last_error,
+            }
+            for c in self.credentials
+        ]
+
+
+_pools = {}
+
+
+def get_pool(name: str, values=(), **options) -> CredentialPool:
+    pool = _pools.get(name)
+    if pool is None:
+        pool = _pools[name] = CredentialPool(name, values, **options)
+    return pool
+
+
+def format_pools() -> str:
+    lines = []
+    for name, pool in sorted(_pools.items()):
+        lines.append(f"🔑 {name}: {len(pool)}")
+        for stat in pool.stats():
+            latency = f"{stat['latency']:.1f}s" if stat['latency'] is not None else "—"
+            line = f" {stat['label']}: ✓{stat['successes']} ✗{stat['failures']} ({stat['score'] * 100:.0f}%), {latency}"
+            if stat['cooldown']:
+                line += f", пауза {int(stat['cooldown'])}s ({stat['last_error']})"
+            lines.append(line)
+    return "\n".join(lines) or "Нет ключей."
@@ -1,24 +1,273 @@
+import asyncio
 import os
-from dotenv import load_dotenv
+import threading
+import time
+from functools import wraps
+import utils.config  # applies .env to os.environ
+
+WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+SWEEP_INTERVAL = int(os.getenv("DB_SWEEP_INTERVAL", 600))
+SWEEP_BATCH = 500
+
+_handles = {}
+_handles_lock = threading.RLock()
+_path_locks = {}
+# write_behind each JSON file was first opened with, by (backend, path).
+_write_behind = {}
+_ttl_tables = {}
+_sweepers = []
+
+def _backend(local: bool) -> str:
+    backend = os.getenv("DB_BACKEND", "").lower() or ("redis" if os.getenv("REDIS_URL") else "json")
+    if local and backend == "redis":
+        return "json"
+    return backend
+
+def _query_class(backend: str):
+    if backend == "json":
+        from tinydb import Query
+    else:
+        from utils.TinyQuery import Query
+    return Query
+
+def _open_tinydb(filepath: str, write_behind: bool):
+    from tinydb import TinyDB
+    if write_behind:
+        from utils.WriteBehindStorage import WriteBehindStorage
+        return TinyDB(filepath, storage=WriteBehindStorage)
+    return TinyDB(filepath)
+
+def _open(filepath: str, backend: str, write_behind: bool, asynchronous: bool, ttl: int):
+    if backend == "redis":
+        if asynchronous:
+            from utils.TinyRedis import AsyncTinyRedisDB
+            return AsyncTinyRedisDB(url=os.getenv("REDIS_URL"), db_name=filepath, ttl=ttl)
+        from utils.TinyRedis import TinyRedisDB
+        return TinyRedisDB(url=os.getenv("REDIS_URL"), db_name=filepath, ttl=ttl)
+    if asynchronous:
+        return AsyncTinyDB(get_handle(filepath, backend, write_behind, ttl=ttl), path_lock(filepath))
+    if backend == "sqlite":
+        from utils.TinySQLite import TinySQLiteDB
+        return TinySQLiteDB(db_name=filepath)
+    return _open_tinydb(filepath, write_behind)
+
+def get_handle(filepath: str, backend: str, write_behind: bool, asynchronous: bool = False, ttl: int = None):
+    # One table object per backend and path for the whole process, so every
+    # module, handler and admin command shares its file handle, cache and
+    # lock. The async wrapper of a file table wraps the shared sync handle.
+    # write_behind only changes how a JSON file is stored; opening one file
+    # both ways would give two TinyDB objects overwriting each other, so a
+    # conflicting request is rejected.
+    key = (backend, filepath if backend == "redis" else os.path.realpath(filepath), asynchronous)
+    handle = _handles.get(key)
+    if handle is None:
+        with _handles_lock:
+            handle = _handles.get(key)
+            if handle is None:
+                _check_write_behind(key[:2], backend, write_behind)
+                handle = _open(filepath, backend, write_behind, asynchronous, ttl)
+                _handles[key] = handle
+    else:
+        _check_write_behind(key[:2], backend, write_behind)
+    return handle
+
+
+def _check_write_behind(path_key, backend: str, write_behind: bool):
+    if backend != "json":
+        return
+    opened = _write_behind.setdefault(path_key, bool(write_behind))
+    if opened != bool(write_behind):
+        raise ValueError(f"{path_key[1]} is already open with write_behind={opened}")
+
+
+def path_lock(filepath: str) -> threading.RLock:
+    # One lock per table file, keyed by its resolved path: TinyDB is not
+    # thread-safe, and the sync tables and the AsyncTinyDB wrappers (whose
+    # calls run in worker threads) must not touch the same file at once.
+    key = os.path.realpath(filepath)
+    with _handles_lock:
+        lock = _path_locks.get(key)
+        if lock is None:
+            lock = _path_locks[key] = threading.RLock()
+        return lock
+
+
+class _LazyTable:
+    # Returned by get_db(): the table is opened on first use rather than
+    # when the importing module is loaded. Calls on a sync JSON table hold
+    # the file's path_lock.
+    def __init__(self, filepath: str, backend: str, write_behind: bool, asynchronous: bool, ttl: int = None):
+        self._args = (filepath, backend, write_behind, asynchronous, ttl)
+        self._handle = None
+        self._lock = path_lock(filepath) if backend == "json" and not asynchronous else None
+
+    def _table(self):
+        if self._handle is None:
+            self._handle = get_handle(*self._args)
+        return self._handle
+
+    def __getattr__(self, name):
+        attr = getattr(self._table(), name)
+        if self._lock is None or not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return locked
+
+    def __iter__(self):
+        if self._lock is None:
+            return iter(self._table())
+        with self._lock:
+            return iter(list(self._table()))
+
+    def __aiter__(self):
+        return self._table().__aiter__()
+
+
+def _register_ttl(filepath: str, backend: str, write_behind: bool, ttl: int, ttl_field: str):
+    if ttl and ttl_field:
+        _ttl_tables[(backend, filepath)] = (write_behind, ttl, ttl_field)
 
-load_dotenv()
 
 class DB:
-    def __init__(self, filepath: str, local: bool = False):
-        if local:
-            from tinydb import Query, TinyDB
-            self.db = TinyDB(filepath)
-            self.Query = Query
-        else:
-            redis_url = os.getenv("REDIS_URL")
-            if redis_url:
-                from utils.TinyRedis import Query, TinyRedisDB
-                self.db = TinyRedisDB(url=redis_url, db_name=filepath)
-                self.Query = Query
-            else:
-                from tinydb import Query, TinyDB
-                self.db = TinyDB(filepath)
-                self.Query = Query
+    # ttl (seconds) marks the table's records as expiring: Redis keys get an
+    # EXPIRE on every write, and the sweeper removes records whose ttl_field
+    # timestamp is older than ttl from every backend.
+    def __init__(self, filepath: str, local: bool = False, write_behind: bool = None, ttl: int = None, ttl_field: str = None):
+        backend = _backend(local)
+        if write_behind is None:
+            write_behind = WRITE_BEHIND
+        _register_ttl(filepath, backend, write_behind, ttl, ttl_field)
+        self.db = _LazyTable(filepath, backend, write_behind, asynchronous=False, ttl=ttl)
+        self.Query = _query_class(backend)
 
     def get_db(self):
         return self.db, self.Query
+
+
+class AsyncTinyDB:
+    # Wraps a synchronous file-backed table (TinyDB or TinySQLite); calls
+    # run in the default executor under the file's path_lock, shared with
+    # the sync handles of the same file.
+    def __init__(self, db, lock: threading.RLock):
+        self._db = db
+        self._lock = lock
+
+    def _call(self, method, *args):
+        with self._lock:
+            return getattr(self._db, method)(*args)
+
+    async def _run(self, method, *args):
+        return await asyncio.to_thread(self._call, method, *args)
+
+    async def get(self, query):
+        return await self._run("get", query)
+
+    async def search(self, query):
+        return await self._run("search", query)
+
+    async def insert(self, data):
+        return await self._run("insert", data)
+
+    async def update(self, fields, query):
+        return await self._run("update", fields, query)
+
+    async def upsert(self, fields, query):
+        return await self._run("upsert", fields, query)
+
+    async def remove(self, query):
+        return await self._run("remove", query)
+
+    async def contains(self, query):
+        return await self._run("contains", query)
+
+    async def all(self):
+        return await self._run("all")
+
+    async def truncate(self):
+        return await self._run("truncate")
+
+    async def __aiter__(self):
+        for record in await self.all():
+            yield record
+
+
+class AsyncDB:
+    def __init__(self, filepath: str, local: bool = False, write_behind: bool = None, ttl: int = None, ttl_field: str = None):
+        backend = _backend(local)
+        if write_behind is None:
+            write_behind = WRITE_BEHIND
+        _register_ttl(filepath, backend, write_behind, ttl, ttl_field)
+        self.db = _LazyTable(filepath, backend, write_behind, asynchronous=True, ttl=ttl)
+        self.Query = _query_class(backend)
+
+    def get_db(self):
+        return self.db, self.Query
+
+
+def flush_all():
+    from utils.WriteBehindStorage import flush_all as flush_storages
+    flush_storages()
+
+
+def _sweep_tinydb(table, lock: threading.RLock, ttl_field: str, ttl: int):
+    # TinyDB rewrites the whole file per remove(), hence the batches.
+    deadline = time.time() - ttl
+    with lock:
+        expired = [doc.doc_id for doc in table if float(doc.get(ttl_field) or 0) < deadline]
+    for i in range(0, len(expired), SWEEP_BATCH):
+        with lock:
+            table.remove(doc_ids=expired[i:i + SWEEP_BATCH])
+
+
+async def sweep_expired():
+    for (backend, filepath), (write_behind, ttl, ttl_field) in list(_ttl_tables.items()):
+        table = get_handle(filepath, backend, write_behind, ttl=ttl)
+        try:
+            if backend == "json":
+                await asyncio.to_thread(_sweep_tinydb, table, path_lock(filepath), ttl_field, ttl)
+            else:
+                await asyncio.to_thread(table.remove_expired, ttl_field, ttl)
+        except Exception as e:
+            print(f"Ошибка очистки {filepath}: {e}")
+    for sweeper in list(_sweepers):
+        try:
+            await asyncio.to_thread(sweeper)
+        except Exception as e:
+            print(f"Ошибка очистки: {e}")
+
+
+def register_sweeper(func):
+    # Extra cleanup callables (run in a worker thread) for stores that
+    # live outside the DB tables, e.g. the conversation logs.
+    _sweepers.append(func)
+
+
+async def _sweeper_loop():
+    while True:
+        await sweep_expired()
+        await asyncio.sleep(SWEEP_INTERVAL)
+
+
+_sweeper_task = None
+
+
+def start_sweeper():
+    global _sweeper_task
+    if _sweeper_task is None or _sweeper_task.done():
+        _sweeper_task = asyncio.create_task(_sweeper_loop())
+    return _sweeper_task
+
+
+async def stop_sweeper():
+    global _sweeper_task
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+        try:
+            await _sweeper_task
+        except asyncio.CancelledError:
+            pass
+        _sweeper_task = None
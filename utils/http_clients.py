@@ -0,0 +1,122 @@
+import os
+from contextlib import asynccontextmanager
+import aiohttp
+import httpx
+
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", 100))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 20))
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+
+
+def _parse_proxies(value: str) -> dict:
+    # HTTP_PROXIES="qwen=http://host:port,translate=http://other:port"
+    proxies = {}
+    for item in value.split(","):
+        name, _, proxy = item.strip().partition("=")
+        if name and proxy:
+            proxies[name.strip()] = proxy.strip()
+    return proxies
+
+
+PROXIES = _parse_proxies(os.getenv("HTTP_PROXIES", ""))
+
+# One keep-alive pool per upstream, so a slow upstream cannot take every
+# connection of another. Per-upstream overrides of the connector limits
+# go here.
+UPSTREAMS = {
+    "default": {},
+    "gpt": {},
+    "gemini": {},
+    "qwen": {"limit_per_host": 50},
+    "yandex": {},
+    "neuro": {},
+    "forecast": {},
+    "translate": {},
+    "rephrase": {},
+    "flux": {},
+    "stt": {},
+    "summary": {},
+    "mushrooms": {"limit_per_host": 4},
+}
+
+_connectors = {}
+_sessions = {}
+_httpx_clients = {}
+
+
+def _connector(upstream: str) -> aiohttp.TCPConnector:
+    connector = _connectors.get(upstream)
+    if connector is None or connector.closed:
+        options = UPSTREAMS.get(upstream, {})
+        connector = _connectors[upstream] = aiohttp.TCPConnector(
+            limit=options.get("limit", HTTP_LIMIT),
+            limit_per_host=options.get("limit_per_host", HTTP_LIMIT_PER_HOST),
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+    return connector
+
+
+def get_session(upstream: str = "default") -> aiohttp.ClientSession:
+    # Shared by every user, so it keeps no cookies.
+    session = _sessions.get(upstream)
+    if session is None or session.closed:
+        session = _sessions[upstream] = aiohttp.ClientSession(
+            connector=_connector(upstream),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            proxy=PROXIES.get(upstream),
+        )
+    return session
+
+
+def new_session(upstream: str = "default", **kwargs) -> aiohttp.ClientSession:
+    # A session of its own (headers, cookies, timeout) that borrows the
+    # upstream's pool; closing it leaves the pool open.
+    kwargs.setdefault("proxy", PROXIES.get(upstream))
+    return aiohttp.ClientSession(connector=_connector(upstream), connector_owner=False, **kwargs)
+
+
+@asynccontextmanager
+async def http_session(upstream: str = "default", cookies: bool = False):
+    # Drop-in for "async with aiohttp.ClientSession() as session": yields
+    # the shared session of the upstream and leaves it open. With
+    # cookies=True the caller gets its own short-lived session, with its
+    # own cookie jar, on the shared connection pool.
+    if not cookies:
+        yield get_session(upstream)
+        return
+    session = new_session(upstream)
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
+def get_httpx_client(upstream: str = "default") -> httpx.AsyncClient:
+    client = _httpx_clients.get(upstream)
+    if client is None or client.is_closed:
+        client = _httpx_clients[upstream] = httpx.AsyncClient(
+            follow_redirects=True,
+            proxy=PROXIES.get(upstream),
+            limits=httpx.Limits(max_connections=HTTP_LIMIT, max_keepalive_connections=HTTP_LIMIT_PER_HOST,
+                                keepalive_expiry=KEEPALIVE_TIMEOUT),
+        )
+    return client
+
+
+async def start_http_clients():
+    for upstream in UPSTREAMS:
+        get_session(upstream)
+
+
+async def close_http_clients():
+    for session in list(_sessions.values()):
+        await session.close()
+    for connector in list(_connectors.values()):
+        await connector.close()
+    for client in list(_httpx_clients.values()):
+        await client.aclose()
+    _sessions.clear()
+    _connectors.clear()
+    _httpx_clients.clear()
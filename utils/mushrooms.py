@@ -0,0 +1,71 @@
+import asyncio
+import re
+from collections import deque
+import aiohttp
+from utils.http_clients import get_session
+
+MUSHROOM_API = "https://toxicshrooms.vercel.app/api/mushrooms/randompic"
+POOL_SIZE = 3
+
+KEYWORDS = [
+    "гриб", "грiб", "грыб",
+    "grib", "gryb", "hrib",
+    "mushroom", "mashroom", "muschroom",
+    "pilz", "champignon",
+    "fungo", "seta", "hongos", "champiñon",
+    "grzyb", "hřib", "huby", "печурка"
+]
+# Applied after lower(): folds look-alike letters and digits so "грїб" or
+# "mushr00m" still match.
+NORMALIZE = str.maketrans({"і": "i", "ї": "i", "ј": "j", "0": "o", "1": "l", "ß": "ss"})
+KEYWORD_PATTERN = re.compile("|".join(re.escape(kw) for kw in sorted(KEYWORDS, key=len, reverse=True)))
+
+_urls = deque()
+_refilling = False
+_tasks = set()
+
+
+def has_mushroom(text: str) -> bool:
+    return KEYWORD_PATTERN.search(text.lower().translate(NORMALIZE)) is not None
+
+
+async def _fetch_url():
+    async with get_session("mushrooms").get(MUSHROOM_API, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+        if resp.status == 200:
+            return (await resp.text()).strip()
+    return None
+
+
+async def _refill():
+    global _refilling
+    if _refilling:
+        return
+    _refilling = True
+    try:
+        while len(_urls) < POOL_SIZE:
+            url = await _fetch_url()
+            if not url:
+                break
+            _urls.append(url)
+    except Exception as e:
+        print(f"Ошибка загрузки грибов: {e}")
+    finally:
+        _refilling = False
+
+
+async def _send(bot, chat_id):
+    try:
+        url = _urls.popleft() if _urls else await _fetch_url()
+        if url:
+            await bot.send_photo(chat_id, url)
+    except Exception as e:
+        print(f"Ошибка отправки гриба: {e}")
+    await _refill()
+
+
+def send_mushroom(bot, chat_id):
+    # Runs off the update path: the handler for the message does not wait
+    # for the image. The task set keeps a reference until it finishes.
+    task = asyncio.create_task(_send(bot, chat_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from utils.circuit_breaker import CircuitOpenError
+
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", 0.2))
+RETRY_BUDGET_MIN_PER_SECOND = 0.5
+RETRY_BUDGET_CAP = 50
+
+
+class RetryBudget:
+    # Retries may add at most `ratio` extra load on top of first attempts:
+    # every request deposits `ratio` tokens, every retry spends one. A small
+    # per-second allowance keeps retries possible at low traffic.
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND,
+                 cap: float = RETRY_BUDGET_CAP):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap
+        self.tokens = cap
+        self.updated_at = time.monotonic()
+        self.requests = 0
+        self.retries = 0
+        self.denied = 0
+
+    def _refill(self, amount: float):
+        now = time.monotonic()
+        amount += (now - self.updated_at) * self.min_per_second
+        self.updated_at = now
+        self.tokens = min(self.cap, self.tokens + amount)
+
+    def record_request(self):
+        self.requests += 1
+        self._refill(self.ratio)
+
+    def try_retry(self) -> bool:
+        self._refill(0)
+        if self.tokens < 1:
+            self.denied += 1
+            return False
+        self.tokens -= 1
+        self.retries += 1
+        return True
+
+
+retry_budget = RetryBudget()
+
+
+def parse_retry_after(value) -> float | None:
+    # Retry-After is either delay-seconds or an HTTP date.
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(response) -> float | None:
+    if response is None:
+        return None
+    return parse_retry_after(response.headers.get("Retry-After"))
+
+
+class RetryPolicy:
+    # Exponential backoff with full jitter: before retry n (0-based) it
+    # sleeps a random time up to min(max_delay, base_delay * 2**n), or the
+    # server's Retry-After when given. A retry happens only if the status or
+    # exception is retryable for this upstream, attempts are left, the
+    # Retry-After fits in max_delay, and the shared budget allows it.
+    def __init__(self, name: str, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 20,
+                 retry_statuses=(429, 500, 502, 503, 504), retry_exceptions=(Exception,),
+                 budget: RetryBudget = retry_budget):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_exceptions = retry_exceptions
+        self.budget = budget
+
+    def start(self):
+        # Call once per logical request, before the first attempt.
+        self.budget.record_request()
+
+    def is_retryable(self, status: int = None, error: BaseException = None) -> bool:
+        if error is not None:
+            return isinstance(error, self.retry_exceptions) and not isinstance(error, CircuitOpenError)
+        return status in self.retry_statuses
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def wait(self, attempt: int, retry_after: float = None, max_attempts: int = None) -> bool:
+        # For hand-written loops: sleeps before the next attempt and returns
+        # True, or returns False when the caller should give up.
+        if attempt + 1 >= (max_attempts or self.max_attempts):
+            return False
+        if retry_after is not None and retry_after > self.max_delay:
+            return False
+        if not self.budget.try_retry():
+            print(f"{self.name}: retry budget exhausted")
+            return False
+        await asyncio.sleep(self.delay(attempt, retry_after))
+        return True
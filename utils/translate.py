@@ -1,4 +1,5 @@
-import aiohttp, os
+import os
+from utils.http_clients import http_session
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
@@ -20,7 +21,7 @@ async def translate_text_alt(text, source_lang='auto', target_lang='ru'):
         "api_key": ""  
     }
 
-    async with aiohttp.ClientSession() as session:
+    async with http_session("translate") as session:
         async with session.post(url, json=payload, headers=headers) as response:
             if response.status == 200:
                 data = await response.json()
@@ -42,7 +43,7 @@ async def translate_text(text, source_lang='auto', target_lang='ru'):
     proxy = os.getenv("PROXY")
     headers = HEADERS.copy()
 
-    async with aiohttp.ClientSession() as session:
+    async with http_session("translate") as session:
         async with session.post(url, data=params, proxy=proxy, headers=headers) as response:
             data = await response.json()
             if data and data[0]:
@@ -61,7 +62,7 @@ async def translate_text_ya(texts, target_language):
         "Authorization": "Api-Key {0}".format(os.getenv("YANDEX_TR_API"))
     }
 
-    async with aiohttp.ClientSession() as session:
+    async with http_session("translate") as session:
         async with session.post('https://translate.api.cloud.yandex.net/translate/v2/translate', json=body, headers=headers) as response:
             if response.status == 200:
                 data = await response.json()